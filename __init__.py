@@ -29,41 +29,128 @@ import warnings
 
 warnings.simplefilter("error")  # noqa
 
+import os
 import sys
-from .testconfig import dsn
+import json
+import fnmatch
 import unittest
+from importlib import import_module
+
+from .testconfig import dsn
+
+testsdir = os.path.dirname(os.path.abspath(__file__))
+
+# File caching the ids of the tests found in every module, used to select the
+# modules to import when tests are chosen by pattern.
+ids_cache = os.path.join(testsdir, ".testids.json")
+
+
+def test_modules():
+    """Return the names of the test modules in the package, without importing them."""
+    rv = []
+    for fn in sorted(os.listdir(testsdir)):
+        if fn.startswith("test_") and fn.endswith(".py"):
+            rv.append(fn[:-3])
+
+    if sys.version_info[:2] >= (3, 6) and "test_async_keyword" in rv:
+        rv.remove("test_async_keyword")
+
+    return rv
+
 
-from . import test_async
-from . import test_bugX000
-from . import test_bug_gc
-from . import test_cancel
-from . import test_connection
-from . import test_copy
-from . import test_cursor
-from . import test_dates
-from . import test_errcodes
-from . import test_errors
-from . import test_extras_dictcursor
-from . import test_fast_executemany
-from . import test_green
-from . import test_ipaddress
-from . import test_lobject
-from . import test_module
-from . import test_notify
-from . import test_psycopg2_dbapi20
-from . import test_quote
-from . import test_replication
-from . import test_sql
-from . import test_transaction
-from . import test_types_basic
-from . import test_types_extras
-from . import test_with
-
-if sys.version_info[:2] < (3, 6):
-    from . import test_async_keyword
-
-
-def test_suite():
+def load_module(name):
+    """Import the test module *name*; return None if it doesn't exist."""
+    if not os.path.exists(os.path.join(testsdir, name + ".py")):
+        sys.stderr.write("test module not found: %s\n" % name)
+        return None
+
+    return import_module("." + name, __name__)
+
+
+def iter_tests(suite):
+    """Yield all the test cases contained in *suite*."""
+    for obj in suite:
+        if isinstance(obj, unittest.TestSuite):
+            for test in iter_tests(obj):
+                yield test
+        else:
+            yield obj
+
+
+def _load_ids_cache():
+    try:
+        with open(ids_cache) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def _save_ids_cache(cache):
+    try:
+        with open(ids_cache, "w") as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+    except IOError:
+        pass
+
+
+def _module_mtime(name):
+    return os.path.getmtime(os.path.join(testsdir, name + ".py"))
+
+
+def select_tests(patterns):
+    """Return a suite of the tests whose id matches one of the *patterns*.
+
+    Test ids are relative to the package, e.g.
+    "test_connection.ConnectionTests.test_reset". Only the modules containing
+    matching tests are imported, according to the ids cache; modules not in the
+    cache or changed since are imported to refresh it.
+    """
+    cache = _load_ids_cache()
+    dirty = False
+    suite = unittest.TestSuite()
+    prefix = __name__ + "."
+    for name in test_modules():
+        entry = cache.get(name)
+        if entry is None or entry["mtime"] != _module_mtime(name):
+            module = load_module(name)
+            if module is None:
+                continue
+            tests = list(iter_tests(module.test_suite()))
+            entry = cache[name] = {
+                "mtime": _module_mtime(name),
+                "ids": [t.id()[len(prefix) :] for t in tests],
+            }
+            dirty = True
+
+        ids = [
+            id
+            for id in entry["ids"]
+            if any(fnmatch.fnmatchcase(id, p) for p in patterns)
+        ]
+        if ids:
+            load_module(name)
+            suite.addTest(
+                unittest.defaultTestLoader.loadTestsFromNames(
+                    ids, sys.modules[__name__]
+                )
+            )
+
+    if dirty:
+        _save_ids_cache(cache)
+
+    return suite
+
+
+def test_suite(names=None):
+    """Return the tests to run.
+
+    *names* is a list of test modules, classes or methods names relative to
+    the package (e.g. "test_connection.ConnectionTests") or of patterns
+    matching test ids (e.g. "*.test_tpc_*"). If not specified, return all the
+    tests in the package.
+
+    Only the test modules needed are imported.
+    """
     # If connection to test db fails, bail out early.
     import psycopg2
 
@@ -76,34 +163,31 @@ def test_suite():
     else:
         cnn.close()
 
+    if names is None:
+        names = test_modules()
+
     suite = unittest.TestSuite()
-    suite.addTest(test_async.test_suite())
-    if sys.version_info[:2] < (3, 6):
-        suite.addTest(test_async_keyword.test_suite())
-    suite.addTest(test_bugX000.test_suite())
-    suite.addTest(test_bug_gc.test_suite())
-    suite.addTest(test_cancel.test_suite())
-    suite.addTest(test_connection.test_suite())
-    suite.addTest(test_copy.test_suite())
-    suite.addTest(test_cursor.test_suite())
-    suite.addTest(test_dates.test_suite())
-    suite.addTest(test_errcodes.test_suite())
-    suite.addTest(test_errors.test_suite())
-    suite.addTest(test_extras_dictcursor.test_suite())
-    suite.addTest(test_fast_executemany.test_suite())
-    suite.addTest(test_green.test_suite())
-    suite.addTest(test_ipaddress.test_suite())
-    suite.addTest(test_lobject.test_suite())
-    suite.addTest(test_module.test_suite())
-    suite.addTest(test_notify.test_suite())
-    suite.addTest(test_psycopg2_dbapi20.test_suite())
-    suite.addTest(test_quote.test_suite())
-    suite.addTest(test_replication.test_suite())
-    suite.addTest(test_sql.test_suite())
-    suite.addTest(test_transaction.test_suite())
-    suite.addTest(test_types_basic.test_suite())
-    suite.addTest(test_types_extras.test_suite())
-    suite.addTest(test_with.test_suite())
+    patterns = []
+    for name in names:
+        if any(c in name for c in "*?["):
+            patterns.append(name)
+            continue
+
+        module = load_module(name.split(".", 1)[0])
+        if module is None:
+            continue
+        if "." in name:
+            suite.addTest(
+                unittest.defaultTestLoader.loadTestsFromName(
+                    name, sys.modules[__name__]
+                )
+            )
+        else:
+            suite.addTest(module.test_suite())
+
+    if patterns:
+        suite.addTest(select_tests(patterns))
+
     return suite
 
 
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+# bench_bulk.py - compare the bulk insert strategies
+#
+# Copyright (C) 2020 The Psycopg Team
+#
+# psycopg2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# psycopg2 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+# License for more details.
+
+"""Measure the bulk insert strategies on a matrix of row shapes and sizes.
+
+Rows are inserted into a table similar to the one in test_fast_executemany.py
+using ``cursor.executemany()``, ``extras.execute_batch()``,
+``extras.execute_values()`` and ``cursor.copy_expert()``, sweeping the page
+size, the columns types and the width of the text columns. For every case the
+rows per second, the client CPU time, the bytes sent and the peak RSS are
+measured; the best page size for every row shape is recommended.
+
+Every case runs in a new process, so that its peak RSS is not affected by the
+other cases. The rows are generated on the fly and their generation is
+included in the client CPU time.
+
+Usage::
+
+    python -m tests.bench_bulk [--rows N,...] [--page-sizes N,...]
+        [--widths N,...] [--mixes NAME,...] [--methods NAME,...]
+        [--repeat R] [--json FILE]
+"""
+
+import sys
+import argparse
+import datetime as dt
+import multiprocessing
+
+import psycopg2
+import psycopg2.extras
+
+from . import fastextras, testconfig, testutils
+from .benchutils import Measure, peak_rss, print_table, write_json
+
+# Column types: name -> (sql type, python value, copy text representation)
+COLUMNS = {
+    "int": ("int", lambda i, w: i, lambda i, w: str(i)),
+    "date": (
+        "date",
+        lambda i, w: dt.date(2020, 1, 1) + dt.timedelta(days=i % 1000),
+        lambda i, w: (dt.date(2020, 1, 1) + dt.timedelta(days=i % 1000)).isoformat(),
+    ),
+    "text": ("text", lambda i, w: "x" * w, lambda i, w: "x" * w),
+}
+
+MIXES = {
+    "int": ["int", "int", "int"],
+    "text": ["int", "text"],
+    "mixed": ["int", "date", "int", "text"],
+}
+
+METHODS = [
+    "executemany",
+    "execute_batch",
+    "execute_batch_stream",
+    "execute_values",
+    "execute_values_stream",
+    "copy",
+]
+
+# Methods whose performance depends on the page size
+PAGED = (
+    "execute_batch",
+    "execute_batch_stream",
+    "execute_values",
+    "execute_values_stream",
+)
+
+
+def table_ddl(mix):
+    return ", ".join("c%d %s" % (i, COLUMNS[t][0]) for i, t in enumerate(MIXES[mix]))
+
+
+def gen_rows(mix, width, nrows):
+    funcs = [COLUMNS[t][1] for t in MIXES[mix]]
+    for i in range(nrows):
+        yield tuple(f(i, width) for f in funcs)
+
+
+class CopyFile(object):
+    """A file-like object generating the COPY data on demand."""
+
+    def __init__(self, mix, width, nrows):
+        self.funcs = [COLUMNS[t][2] for t in MIXES[mix]]
+        self.width = width
+        self.rows = iter(range(nrows))
+        self.buffer = ""
+        self.size = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            i = next(self.rows, None)
+            if i is None:
+                break
+            self.buffer += "\t".join(f(i, self.width) for f in self.funcs) + "\n"
+
+        if size < 0:
+            size = len(self.buffer)
+        rv, self.buffer = self.buffer[:size], self.buffer[size:]
+        self.size += len(rv)
+        return rv
+
+
+def run_case(method, mix, width, nrows, page_size, repeat):
+    """Measure a single case; return the `Measure` of the case.
+
+    Meant to run in a new process.
+    """
+    conn = psycopg2.connect(
+        testconfig.dsn, connection_factory=testutils.CountingConnection
+    )
+    cur = conn.cursor()
+    cur.execute("create temp table bench_bulk (%s)" % table_ddl(mix))
+    conn.commit()
+
+    ncols = len(MIXES[mix])
+    insert = "insert into bench_bulk values (%s)" % ", ".join(["%s"] * ncols)
+    sent = [0]
+
+    def setup():
+        cur.execute("truncate bench_bulk")
+        conn.commit()
+
+    def run():
+        before = testutils.stats.bytes_out
+        if method == "copy":
+            f = CopyFile(mix, width, nrows)
+            cur.copy_expert("copy bench_bulk from stdin", f, size=65536)
+            sent[0] = f.size
+        else:
+            rows = gen_rows(mix, width, nrows)
+            if method == "executemany":
+                cur.executemany(insert, rows)
+            elif method == "execute_batch":
+                psycopg2.extras.execute_batch(cur, insert, rows, page_size=page_size)
+            elif method == "execute_batch_stream":
+                fastextras.execute_batch_stream(cur, insert, rows, page_size=page_size)
+            elif method == "execute_values":
+                psycopg2.extras.execute_values(
+                    cur, "insert into bench_bulk values %s", rows, page_size=page_size
+                )
+            elif method == "execute_values_stream":
+                fastextras.execute_values_stream(
+                    cur, "insert into bench_bulk values %s", rows, page_size=page_size
+                )
+            sent[0] = testutils.stats.bytes_out - before
+        conn.commit()
+
+    m = Measure(
+        "bulk_insert",
+        nrows,
+        method=method,
+        mix=mix,
+        width=width,
+        rows=nrows,
+        page_size=page_size if method in PAGED else None,
+    )
+    m.run(run, repeat=repeat, setup=setup)
+    conn.close()
+
+    m.params["bytes_out"] = sent[0]
+    m.params["peak_rss"] = peak_rss()
+    return m
+
+
+def iter_cases(opt):
+    for nrows in opt.rows:
+        for mix in opt.mixes:
+            # the width only matters for the text columns
+            widths = opt.widths if "text" in MIXES[mix] else [0]
+            for width in widths:
+                for method in opt.methods:
+                    if method == "executemany" and nrows > opt.executemany_max:
+                        continue
+                    page_sizes = opt.page_sizes if method in PAGED else [None]
+                    for page_size in page_sizes:
+                        yield method, mix, width, nrows, page_size
+
+
+def recommend_page_sizes(measures):
+    """Return the best page size for every row shape and paged method.
+
+    The page size is chosen on the largest number of rows measured.
+    Return a list of dicts with keys method, mix, width, page_size, throughput.
+    """
+    best = {}
+    for m in measures:
+        p = m.params
+        if p["method"] not in PAGED:
+            continue
+        key = (p["method"], p["mix"], p["width"])
+        other = best.get(key)
+        if (
+            other is None
+            or p["rows"] > other.params["rows"]
+            or (p["rows"] == other.params["rows"] and m.throughput > other.throughput)
+        ):
+            best[key] = m
+
+    return [
+        {
+            "method": method,
+            "mix": mix,
+            "width": width,
+            "page_size": m.params["page_size"],
+            "throughput": m.throughput,
+        }
+        for (method, mix, width), m in sorted(best.items())
+    ]
+
+
+def int_list(s):
+    return [int(float(i)) for i in s.split(",")]
+
+
+def name_list(choices):
+    def name_list_(s):
+        rv = s.split(",")
+        for name in rv:
+            if name not in choices:
+                raise argparse.ArgumentTypeError(
+                    "bad name: %s; choices are: %s" % (name, ", ".join(choices))
+                )
+        return rv
+
+    return name_list_
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--rows",
+        type=int_list,
+        default=[1000, 100000],
+        help="numbers of rows to insert, e.g. 1e3,1e7 [default: 1e3,1e5]",
+    )
+    parser.add_argument(
+        "--page-sizes",
+        type=int_list,
+        default=[100, 1000, 10000],
+        help="page sizes to try [default: 100,1000,10000]",
+    )
+    parser.add_argument(
+        "--widths",
+        type=int_list,
+        default=[16, 256],
+        help="widths of the text columns [default: 16,256]",
+    )
+    parser.add_argument(
+        "--mixes",
+        type=name_list(sorted(MIXES)),
+        default=sorted(MIXES),
+        help="column mixes, among: %s" % ", ".join(sorted(MIXES)),
+    )
+    parser.add_argument(
+        "--methods",
+        type=name_list(METHODS),
+        default=METHODS,
+        help="insert methods, among: %s" % ", ".join(METHODS),
+    )
+    parser.add_argument(
+        "--executemany-max",
+        type=int,
+        default=10000,
+        metavar="N",
+        help="don't try executemany() on more than N rows [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per case [default: %(default)s]"
+    )
+    parser.add_argument("--json", metavar="FILE", help="save the results to FILE")
+    opt = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    measures = []
+    rows = []
+    for method, mix, width, nrows, page_size in iter_cases(opt):
+        pool = ctx.Pool(1)
+        try:
+            m = pool.apply(run_case, (method, mix, width, nrows, page_size, opt.repeat))
+        finally:
+            pool.terminate()
+        measures.append(m)
+
+        row = [
+            method,
+            mix,
+            str(width),
+            str(nrows),
+            str(page_size or ""),
+            "%.0f" % m.throughput,
+            "%.3f" % m.cpu,
+            "%d" % m.params["bytes_out"],
+            "%.1f" % (m.params["peak_rss"] / 1048576.0),
+        ]
+        rows.append(row)
+        sys.stderr.write("  ".join(row) + "\n")
+
+    headers = ["method", "mix", "width", "rows", "page", "rows/s"]
+    headers += ["cpu s", "bytes out", "rss MB"]
+    print_table(sys.stdout, headers, rows)
+
+    recommended = recommend_page_sizes(measures)
+    sys.stdout.write("\nRecommended page sizes:\n")
+    print_table(
+        sys.stdout,
+        ["method", "mix", "width", "page", "rows/s"],
+        [
+            [
+                r["method"],
+                r["mix"],
+                str(r["width"]),
+                str(r["page_size"]),
+                "%.0f" % r["throughput"],
+            ]
+            for r in recommended
+        ],
+    )
+
+    if opt.json:
+        write_json(
+            opt.json,
+            measures,
+            psycopg2=psycopg2.__version__,
+            recommended_page_sizes=recommended,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# bench_memory.py - check the memory used by the bulk insert helpers
+#
+# Copyright (C) 2020 The Psycopg Team
+#
+# psycopg2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# psycopg2 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+# License for more details.
+
+"""Check that the peak RSS of the bulk insert helpers doesn't grow with the rows.
+
+Every method inserts an increasing number of rows, generated on the fly, each
+run in a new process (see bench_bulk.py). The peak RSS of the largest run is
+compared with the one of the smallest: the program fails if the streaming
+methods grow more than the tolerance.
+
+Usage::
+
+    python -m tests.bench_memory [--rows N,...] [--page-size N]
+        [--max-growth MB] [--json FILE]
+"""
+
+import sys
+import argparse
+import multiprocessing
+
+import psycopg2
+
+from . import bench_bulk
+from .benchutils import print_table, write_json
+
+METHODS = [
+    "execute_batch",
+    "execute_batch_stream",
+    "execute_values",
+    "execute_values_stream",
+]
+
+# Methods which must use constant memory
+STREAMING = ("execute_batch_stream", "execute_values_stream")
+
+MB = 1048576.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--rows",
+        type=bench_bulk.int_list,
+        default=[10**5, 10**6, 10**7],
+        help="numbers of rows to insert [default: 1e5,1e6,1e7]",
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=1000,
+        help="rows per statement [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--max-growth",
+        type=float,
+        default=10.0,
+        metavar="MB",
+        help="peak RSS growth tolerated [default: %(default)s]",
+    )
+    parser.add_argument("--json", metavar="FILE", help="save the results to FILE")
+    opt = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    measures = []
+    rows = []
+    failed = []
+    for method in METHODS:
+        rss = []
+        for nrows in sorted(opt.rows):
+            pool = ctx.Pool(1)
+            try:
+                m = pool.apply(
+                    bench_bulk.run_case,
+                    (method, "mixed", 16, nrows, opt.page_size, 1),
+                )
+            finally:
+                pool.terminate()
+            measures.append(m)
+            rss.append(m.params["peak_rss"])
+            sys.stderr.write("%s %d rows: %.1f MB\n" % (method, nrows, rss[-1] / MB))
+
+        growth = (rss[-1] - rss[0]) / MB
+        if method in STREAMING and growth > opt.max_growth:
+            failed.append(method)
+        rows.append([method] + ["%.1f" % (r / MB) for r in rss] + ["%+.1f" % growth])
+
+    headers = ["method"] + ["%d rows MB" % n for n in sorted(opt.rows)] + ["growth"]
+    print_table(sys.stdout, headers, rows)
+
+    if opt.json:
+        write_json(opt.json, measures, psycopg2=psycopg2.__version__)
+
+    if failed:
+        sys.stderr.write(
+            "\nRSS growing more than %s MB: %s\n" % (opt.max_growth, ", ".join(failed))
+        )
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+# bench_parity.py - compare psycopg2 and psycopg 3 on the same operations
+#
+# Copyright (C) 2020 The Psycopg Team
+#
+# psycopg2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# psycopg2 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+# License for more details.
+
+"""Compare the performance of psycopg2 and psycopg 3 on equivalent operations.
+
+Every scenario runs an operation exercised by the tests in this repository
+through psycopg2 and through its psycopg 3 counterpart, on the test database.
+If psycopg 3 is not installed only psycopg2 is measured.
+
+Usage::
+
+    python -m tests.bench_parity [--items N] [--repeat R] [--json FILE]
+        [scenario ...]
+"""
+
+import sys
+import argparse
+
+import psycopg2
+import psycopg2.extras
+
+from . import testconfig
+from .benchutils import Measure, print_table, write_json
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+
+SCENARIOS = {}
+
+
+def scenario(f):
+    """Register a scenario.
+
+    The function receives the driver name, a connection and the number of
+    items to process; it returns a pair of callables (setup, run) to measure.
+    """
+    SCENARIOS[f.__name__] = f
+    return f
+
+
+@scenario
+def insert_values(driver, conn, n):
+    """extras.execute_values() vs. cursor.executemany()"""
+    cur = conn.cursor()
+    cur.execute("create temp table bench_parity (id int, data text, val int)")
+    conn.commit()
+    rows = [(i, "row %s" % i, i * 10) for i in range(n)]
+
+    def setup():
+        cur.execute("truncate bench_parity")
+        conn.commit()
+
+    if driver == "psycopg2":
+
+        def run():
+            psycopg2.extras.execute_values(
+                cur, "insert into bench_parity values %s", rows
+            )
+            conn.commit()
+
+    else:
+
+        def run():
+            cur.executemany("insert into bench_parity values (%s, %s, %s)", rows)
+            conn.commit()
+
+    return setup, run
+
+
+@scenario
+def fetch_namedtuples(driver, conn, n):
+    """NamedTupleCursor vs. namedtuple_row"""
+    query = (
+        "select i as id, i::text as data, i * 10 as val"
+        " from generate_series(1, %s) as i"
+    )
+    if driver == "psycopg2":
+        cur = conn.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
+    else:
+        from psycopg.rows import namedtuple_row
+
+        cur = conn.cursor(row_factory=namedtuple_row)
+
+    def run():
+        cur.execute(query, (n,))
+        cur.fetchall()
+        conn.rollback()
+
+    return None, run
+
+
+@scenario
+def read_large_object(driver, conn, n):
+    """lobject.read() vs. lo_get()"""
+    # psycopg 3 has no large objects API: read them with the server function.
+    # The object is never committed, so it goes away with the connection.
+    cur = conn.cursor()
+    cur.execute("select lo_from_bytea(0, decode(repeat('x', %s), 'escape'))", (n,))
+    oid = cur.fetchone()[0]
+
+    if driver == "psycopg2":
+
+        def run():
+            conn.lobject(oid, "rb").read()
+
+    else:
+
+        def run():
+            cur.execute("select lo_get(%s)", (oid,))
+            cur.fetchone()
+
+    return None, run
+
+
+@scenario
+def parse_hstore(driver, conn, n):
+    """HstoreAdapter.parse() vs. the hstore loader"""
+    s = ", ".join('"key%d"=>"value %d"' % (i, i) for i in range(n))
+    if driver == "psycopg2":
+
+        def run():
+            psycopg2.extras.HstoreAdapter.parse(s, None)
+
+    else:
+        from psycopg.types import TypeInfo
+        from psycopg.types.hstore import register_hstore
+
+        info = TypeInfo.fetch(conn, "hstore")
+        if info is None:
+            raise Skip("hstore not available in the test database")
+        register_hstore(info, conn)
+        loader = conn.adapters.get_loader(info.oid, psycopg.pq.Format.TEXT)(
+            info.oid, conn
+        )
+        data = s.encode()
+
+        def run():
+            loader.load(data)
+
+    return None, run
+
+
+class Skip(Exception):
+    """Raised by a scenario which can't run in the current environment."""
+
+
+def connect(driver):
+    if driver == "psycopg2":
+        return psycopg2.connect(testconfig.dsn)
+    else:
+        return psycopg.connect(testconfig.dsn)
+
+
+def measure(name, driver, items, repeat):
+    conn = connect(driver)
+    try:
+        setup, run = SCENARIOS[name](driver, conn, items)
+        m = Measure(name, items, driver=driver)
+        return m.run(run, repeat=repeat, setup=setup)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        metavar="scenario",
+        help="scenarios to run, among: %s" % ", ".join(sorted(SCENARIOS)),
+    )
+    parser.add_argument(
+        "--items",
+        type=int,
+        default=10000,
+        help="items processed by every scenario [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="runs per scenario [default: %(default)s]"
+    )
+    parser.add_argument("--json", metavar="FILE", help="save the results to FILE")
+    opt = parser.parse_args()
+
+    drivers = ["psycopg2"]
+    if psycopg is not None:
+        drivers.append("psycopg")
+    else:
+        sys.stderr.write("psycopg 3 not installed: measuring psycopg2 only\n")
+
+    measures = []
+    rows = []
+    for name in opt.scenarios or sorted(SCENARIOS):
+        base = None
+        for driver in drivers:
+            try:
+                m = measure(name, driver, opt.items, opt.repeat)
+            except Skip as e:
+                sys.stderr.write("%s skipped on %s: %s\n" % (name, driver, e))
+                continue
+            measures.append(m)
+            if base is None:
+                base = m
+            rows.append(
+                [
+                    name,
+                    driver,
+                    "%.0f" % m.throughput,
+                    "%.2f" % (m.mean * 1000),
+                    "%.2f" % (m.percentile(95) * 1000),
+                    "%.2f" % (m.cpu * 1000),
+                    "%.2fx" % (m.throughput / base.throughput),
+                ]
+            )
+
+    print_table(
+        sys.stdout,
+        ["scenario", "driver", "items/s", "mean ms", "p95 ms", "cpu ms", "vs psycopg2"],
+        rows,
+    )
+
+    if opt.json:
+        info = {"items": opt.items, "psycopg2": psycopg2.__version__}
+        if psycopg is not None:
+            info["psycopg"] = psycopg.__version__
+        write_json(opt.json, measures, **info)
+
+
+if __name__ == "__main__":
+    main()
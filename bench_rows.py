@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# bench_rows.py - compare the record classes of the named tuple cursors
+#
+# Copyright (C) 2020 The Psycopg Team
+#
+# psycopg2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# psycopg2 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+# License for more details.
+
+"""Compare NamedTupleCursor with CompactNamedTupleCursor on large fetches.
+
+For every cursor the rows per second fetched by ``fetchall()`` and the memory
+allocated per row are measured, together with the time to build the record
+class of a new set of columns. A plain cursor, returning tuples, is measured
+as baseline.
+
+Usage::
+
+    python -m tests.bench_rows [--rows N] [--columns N] [--classes N]
+        [--repeat R] [--json FILE]
+"""
+
+import sys
+import argparse
+import tracemalloc
+
+import psycopg2
+import psycopg2.extensions as ext
+import psycopg2.extras
+
+from . import fastextras, testconfig
+from .benchutils import Measure, print_table, write_json
+
+CURSORS = {
+    "tuple": ext.cursor,
+    "namedtuple": psycopg2.extras.NamedTupleCursor,
+    "compact": fastextras.CompactNamedTupleCursor,
+}
+
+
+def fetch_query(ncols):
+    cols = ", ".join("i + %d as col%d" % (n, n) for n in range(ncols))
+    return "select %s from generate_series(1, %%s) as i" % cols
+
+
+def measure_fetch(conn, name, nrows, ncols, repeat):
+    cur = conn.cursor(cursor_factory=CURSORS[name])
+    query = fetch_query(ncols)
+
+    def run():
+        cur.execute(query, (nrows,))
+        cur.fetchall()
+
+    m = Measure("fetchall", nrows, cursor=name, rows=nrows, columns=ncols)
+    m.run(run, repeat=repeat)
+
+    # Measure the memory separately: tracing slows the allocations down
+    cur.execute(query, (nrows,))
+    tracemalloc.start()
+    try:
+        rows = cur.fetchall()
+        m.params["bytes_per_row"] = tracemalloc.get_traced_memory()[0] / nrows
+    finally:
+        tracemalloc.stop()
+    del rows
+
+    return m
+
+
+def measure_classes(name, nclasses, ncols, repeat):
+    cls = CURSORS[name]
+    keys = [tuple("col%d_%d" % (n, i) for n in range(ncols)) for i in range(nclasses)]
+
+    def run():
+        for key in keys:
+            cls._do_make_nt(key)
+
+    m = Measure("make_class", nclasses, cursor=name, columns=ncols)
+    return m.run(run, repeat=repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--rows",
+        type=lambda s: int(float(s)),
+        default=10**6,
+        help="rows to fetch [default: 1e6]",
+    )
+    parser.add_argument(
+        "--columns",
+        type=int,
+        default=5,
+        help="columns per row [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--classes",
+        type=int,
+        default=1000,
+        help="record classes to build [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per case [default: %(default)s]"
+    )
+    parser.add_argument("--json", metavar="FILE", help="save the results to FILE")
+    opt = parser.parse_args()
+
+    measures = []
+    rows = []
+    conn = psycopg2.connect(testconfig.dsn)
+    try:
+        for name in CURSORS:
+            m = measure_fetch(conn, name, opt.rows, opt.columns, opt.repeat)
+            measures.append(m)
+            row = [name, "%.0f" % m.throughput, "%.0f" % m.params["bytes_per_row"]]
+
+            if name == "tuple":
+                row.append("")
+            else:
+                c = measure_classes(name, opt.classes, opt.columns, opt.repeat)
+                measures.append(c)
+                row.append("%.1f" % (c.best / c.items * 1e6))
+
+            rows.append(row)
+            sys.stderr.write("  ".join(row) + "\n")
+    finally:
+        conn.close()
+
+    print_table(sys.stdout, ["cursor", "rows/s", "bytes/row", "class us"], rows)
+
+    if opt.json:
+        write_json(opt.json, measures, psycopg2=psycopg2.__version__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# benchutils.py - utility module for the benchmarks
+#
+# Copyright (C) 2020 The Psycopg Team
+#
+# psycopg2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# psycopg2 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+# License for more details.
+
+"""Measurement and reporting helpers shared by the bench_* modules.
+
+The benchmarks are not part of the test suite: run them as modules, e.g.
+``python -m tests.bench_parity --help``.
+"""
+
+import sys
+import json
+import time
+import resource
+
+
+class Measure(object):
+    """The timings of a benchmark scenario.
+
+    *items* is the number of items (rows, values...) processed by every run,
+    used to compute the throughput.
+    """
+
+    def __init__(self, scenario, items=1, **params):
+        self.scenario = scenario
+        self.items = items
+        self.params = params
+        self.times = []
+        self.cpu_times = []
+
+    def run(self, f, repeat=5, setup=None):
+        """Call *f* *repeat* times, measuring wall and CPU time of every call.
+
+        *setup*, if specified, is called before every run and not measured.
+        """
+        for i in range(repeat):
+            if setup is not None:
+                setup()
+            t0 = time.perf_counter()
+            c0 = time.process_time()
+            f()
+            self.cpu_times.append(time.process_time() - c0)
+            self.times.append(time.perf_counter() - t0)
+        return self
+
+    @property
+    def mean(self):
+        return sum(self.times) / len(self.times)
+
+    @property
+    def best(self):
+        return min(self.times)
+
+    def percentile(self, p):
+        times = sorted(self.times)
+        return times[min(len(times) - 1, int(len(times) * p / 100.0))]
+
+    @property
+    def throughput(self):
+        """Items processed per second, in the best run."""
+        return self.items / self.best
+
+    @property
+    def cpu(self):
+        """Client CPU seconds used, in the best run."""
+        return min(self.cpu_times)
+
+    def as_dict(self):
+        rv = dict(self.params)
+        rv.update(
+            scenario=self.scenario,
+            items=self.items,
+            times=self.times,
+            mean=self.mean,
+            best=self.best,
+            p95=self.percentile(95),
+            throughput=self.throughput,
+            cpu=self.cpu,
+        )
+        return rv
+
+
+def peak_rss():
+    """Return the peak resident set size of the process in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def write_json(filename, measures, **info):
+    """Save the *measures* into *filename*, together with *info*."""
+    data = dict(info)
+    data["results"] = [m.as_dict() for m in measures]
+    with open(filename, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def print_table(stream, headers, rows):
+    """Print *rows* (sequences of strings) in columns under *headers*."""
+    widths = [len(h) for h in headers]
+    for row in rows:
+        widths = [max(w, len(c)) for w, c in zip(widths, row)]
+
+    stream.write("  ".join(h.ljust(w) for h, w in zip(headers, widths)) + "\n")
+    stream.write("  ".join("-" * w for w in widths) + "\n")
+    for row in rows:
+        stream.write("  ".join(c.rjust(w) for c, w in zip(row, widths)) + "\n")
@@ -0,0 +1,1416 @@
+# fastextras.py - experimental variants of the psycopg2.extras fast helpers
+#
+# Copyright (C) 2020 The Psycopg Team
+#
+# psycopg2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# psycopg2 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+# License for more details.
+
+"""Variants of `psycopg2.extras.execute_values()`, `!NamedTupleCursor` and friends.
+
+The functions work with the installed psycopg2 and are tested, and measured,
+in the same way as the extras they are based on.
+"""
+
+import re
+import json
+import time
+import uuid
+import ctypes
+import select
+import struct
+import weakref
+import threading
+import datetime as dt
+from operator import itemgetter
+from itertools import islice
+from collections import OrderedDict, deque, namedtuple
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions as ext
+from psycopg2.extras import Json, NamedTupleConnection, NamedTupleCursor
+from psycopg2.extras import _re_clean, _split_sql
+from psycopg2 import sql as pgsql
+from psycopg2.sql import Composable
+
+from .testutils import ConnectionPool, native_pointer
+
+
+def _prepare_values_sql(cur, sql):
+    """Return the *sql* of an `execute_values()` split as pre, post snippets."""
+    if isinstance(sql, Composable):
+        sql = sql.as_string(cur)
+    if not isinstance(sql, bytes):
+        sql = sql.encode(ext.encodings[cur.connection.encoding])
+    return _split_sql(sql)
+
+
+def _default_template(args):
+    return b"(" + b",".join([b"%s"] * len(args)) + b")"
+
+
+class _PageBuffer(object):
+    """Accumulate the items of a page into a statement.
+
+    The items are joined by *sep* into a `!bytearray` between the *pre* and
+    *post* snippets. The buffer is reused for all the pages, so its memory is
+    allocated only once for the largest page.
+    """
+
+    def __init__(self, pre=(), post=(), sep=b","):
+        self.head = b"".join(pre)
+        self.tail = b"".join(post)
+        self.sep = sep
+        self.buf = bytearray(self.head)
+        self.nitems = 0
+
+    @property
+    def nbytes(self):
+        """The length of the statement of the current page."""
+        return len(self.buf) + len(self.tail)
+
+    def append(self, item):
+        if self.nitems:
+            self.buf += self.sep
+        self.buf += item
+        self.nitems += 1
+
+    def pop(self):
+        """Return the statement of the current page and start a new one."""
+        self.buf += self.tail
+        rv = bytes(self.buf)
+        del self.buf[len(self.head) :]
+        self.nitems = 0
+        return rv
+
+
+def execute_batch_stream(cur, sql, argslist, page_size=100):
+    """Like `~psycopg2.extras.execute_batch()`, using less memory.
+
+    Every item of *argslist* is merged into the statement as soon as it is
+    read, so that at most a page of statements is held in memory, as bytes.
+    """
+    page = _PageBuffer(sep=b";")
+    for args in argslist:
+        page.append(cur.mogrify(sql, args))
+        if page.nitems >= page_size:
+            cur.execute(page.pop())
+
+    if page.nitems:
+        cur.execute(page.pop())
+
+
+def execute_values_stream(
+    cur, sql, argslist, template=None, page_size=100, fetch=False
+):
+    """Like `~psycopg2.extras.execute_values()`, using less memory.
+
+    Every item of *argslist* is merged into the statement as soon as it is
+    read, so that at most a page of values is held in memory, as bytes.
+    """
+    result = [] if fetch else None
+    for _ in _execute_values_pages(cur, sql, argslist, template, page_size):
+        if fetch:
+            result.extend(cur.fetchall())
+
+    return result
+
+
+def execute_values_iter(cur, sql, argslist, template=None, page_size=100):
+    """Execute `execute_values_stream()` and iterate on the results.
+
+    Return a generator: the statements are executed while it is consumed, and
+    the rows returned by every page (for instance by a :sql:`RETURNING`
+    clause) are yielded as soon as the page is executed. Only the results of
+    one page at time are held in memory.
+
+    The cursor is used by the generator until it is exhausted: don't use it
+    to execute other queries meanwhile.
+    """
+    for _ in _execute_values_pages(cur, sql, argslist, template, page_size):
+        for row in cur.fetchall():
+            yield row
+
+
+def _execute_values_pages(cur, sql, argslist, template, page_size):
+    """Execute the pages of an `execute_values()`, yielding after each one."""
+    pre, post = _prepare_values_sql(cur, sql)
+    page = _PageBuffer(pre, post)
+
+    for args in argslist:
+        if template is None:
+            template = _default_template(args)
+        page.append(cur.mogrify(template, args))
+        if page.nitems >= page_size:
+            cur.execute(page.pop())
+            yield
+
+    if page.nitems:
+        cur.execute(page.pop())
+        yield
+
+
+class PageSizer(object):
+    """Choose the number of items of every page of an adaptive execution.
+
+    A page is closed when it contains *page_size* items or when its statement
+    reaches *max_bytes*. After every page is executed `update()` adjusts the
+    page size: it is doubled if the page was executed in less than half
+    *target_time* seconds and halved if it took more than *target_time*,
+    within *min_size* and *max_size*.
+    """
+
+    def __init__(
+        self,
+        page_size=100,
+        max_bytes=1 << 20,
+        target_time=0.1,
+        min_size=1,
+        max_size=10000,
+    ):
+        self.page_size = page_size
+        self.max_bytes = max_bytes
+        self.target_time = target_time
+        self.min_size = min_size
+        self.max_size = max_size
+        self.sizes = []
+
+    def full(self, nitems, nbytes):
+        """Return True if a page of *nitems* items, *nbytes* long, is complete."""
+        return nitems >= self.page_size or nbytes >= self.max_bytes
+
+    def update(self, nitems, nbytes, elapsed):
+        """Adjust the page size after a page has been executed."""
+        self.sizes.append(nitems)
+        if elapsed > self.target_time:
+            self.page_size = max(self.min_size, nitems // 2)
+        elif elapsed < self.target_time / 2 and nbytes < self.max_bytes:
+            if nitems >= self.page_size:
+                self.page_size = min(self.max_size, self.page_size * 2)
+
+
+def execute_values_adaptive(
+    cur,
+    sql,
+    argslist,
+    template=None,
+    page_size=100,
+    fetch=False,
+    max_bytes=1 << 20,
+    target_time=0.1,
+    sizer=None,
+):
+    """Like `~psycopg2.extras.execute_values()`, with pages of variable size.
+
+    *page_size* is only the size of the first page: the following pages grow
+    while the server executes them in less than half *target_time* seconds
+    and shrink if they take longer than *target_time*. A page is anyway
+    executed as soon as its statement reaches *max_bytes* bytes, so wide rows
+    don't produce huge statements.
+
+    A `PageSizer` can be passed as *sizer* to tune the bounds of the page size
+    or to inspect, in its `!sizes` attribute, the number of items executed in
+    every page.
+
+    With *fetch* return the results of all the pages as a single list.
+    """
+    pre, post = _prepare_values_sql(cur, sql)
+    if sizer is None:
+        sizer = PageSizer(page_size, max_bytes, target_time)
+
+    page = _PageBuffer(pre, post)
+    result = [] if fetch else None
+
+    for args in argslist:
+        if template is None:
+            template = _default_template(args)
+        page.append(cur.mogrify(template, args))
+        if sizer.full(page.nitems, page.nbytes):
+            _execute_page(cur, page, sizer, result)
+
+    if page.nitems:
+        _execute_page(cur, page, sizer, result)
+
+    return result
+
+
+def _execute_page(cur, page, sizer, result):
+    nitems = page.nitems
+    nbytes = page.nbytes
+    t0 = time.time()
+    cur.execute(page.pop())
+    if result is not None:
+        result.extend(cur.fetchall())
+    sizer.update(nitems, nbytes, time.time() - t0)
+
+
+# libpq ExecStatusType values
+PGRES_COMMAND_OK = 1
+PGRES_TUPLES_OK = 2
+PGRES_PIPELINE_SYNC = 10
+PGRES_PIPELINE_ABORTED = 11
+
+PG_DIAG_SQLSTATE = ord("C")
+
+_libpq_pipeline = None
+
+
+def _libpq():
+    """Return the libpq used by psycopg2, wrapped by ctypes.
+
+    The functions are looked up through the psycopg2 extension module, so that
+    they come from the same library managing its connections.
+    """
+    global _libpq_pipeline
+    if _libpq_pipeline is not None:
+        return _libpq_pipeline
+
+    if ext.libpq_version() < 140000:
+        raise psycopg2.NotSupportedError("pipeline mode requires libpq >= 14")
+
+    lib = ctypes.CDLL(psycopg2._psycopg.__file__)
+    PGconn = PGresult = ctypes.c_void_p
+    for name, restype, argtypes in [
+        ("PQenterPipelineMode", ctypes.c_int, [PGconn]),
+        ("PQexitPipelineMode", ctypes.c_int, [PGconn]),
+        ("PQpipelineSync", ctypes.c_int, [PGconn]),
+        (
+            "PQsendQueryParams",
+            ctypes.c_int,
+            [PGconn, ctypes.c_char_p, ctypes.c_int]
+            + [ctypes.c_void_p] * 4
+            + [ctypes.c_int],
+        ),
+        ("PQgetResult", PGresult, [PGconn]),
+        ("PQresultStatus", ctypes.c_int, [PGresult]),
+        ("PQcmdTuples", ctypes.c_char_p, [PGresult]),
+        ("PQresultErrorMessage", ctypes.c_char_p, [PGresult]),
+        ("PQresultErrorField", ctypes.c_char_p, [PGresult, ctypes.c_int]),
+        ("PQclear", None, [PGresult]),
+        ("PQisnonblocking", ctypes.c_int, [PGconn]),
+        ("PQsetnonblocking", ctypes.c_int, [PGconn, ctypes.c_int]),
+        ("PQflush", ctypes.c_int, [PGconn]),
+        ("PQconsumeInput", ctypes.c_int, [PGconn]),
+        ("PQisBusy", ctypes.c_int, [PGconn]),
+        ("PQerrorMessage", ctypes.c_char_p, [PGconn]),
+    ]:
+        f = getattr(lib, name)
+        f.restype = restype
+        f.argtypes = argtypes
+
+    _libpq_pipeline = lib
+    return lib
+
+
+class PipelineResult(object):
+    """The outcome of the statements executed by `execute_batch_pipeline()`.
+
+    `rowcounts` has an item per statement: the number of rows it affected
+    (-1 if not available), or None if it failed or was not executed.
+    `errors` is a list of (index, exception) for the statements failed.
+    """
+
+    def __init__(self):
+        self.rowcounts = []
+        self.errors = []
+
+
+class _Pipeline(object):
+    """Send statements to a psycopg connection in libpq pipeline mode."""
+
+    def __init__(self, conn):
+        self.libpq = _libpq()
+        self.pgconn = ctypes.c_void_p(native_pointer(conn))
+        self.fileno = conn.fileno()
+        self.encoding = ext.encodings[conn.encoding]
+        self.pending = deque()
+
+    def __enter__(self):
+        if not self.libpq.PQenterPipelineMode(self.pgconn):
+            self._raise()
+        self.nonblocking = self.libpq.PQisnonblocking(self.pgconn)
+        # non-blocking, so that the server results can be consumed while we
+        # are still sending: otherwise both sides may wait on full buffers.
+        self.libpq.PQsetnonblocking(self.pgconn, 1)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        try:
+            # results must be consumed to leave the pipeline mode
+            while self.pending:
+                self.read_page(PipelineResult())
+        finally:
+            self.libpq.PQsetnonblocking(self.pgconn, self.nonblocking)
+            self.libpq.PQexitPipelineMode(self.pgconn)
+
+    def send_page(self, statements):
+        """Send a group of *statements* followed by a sync point."""
+        for stmt in statements:
+            if not self.libpq.PQsendQueryParams(
+                self.pgconn, stmt, 0, None, None, None, None, 0
+            ):
+                self._raise()
+        if not self.libpq.PQpipelineSync(self.pgconn):
+            self._raise()
+        self.pending.append(len(statements))
+        self._flush()
+
+    def read_page(self, result):
+        """Read the results of the oldest page sent into a `PipelineResult`."""
+        for i in range(self.pending.popleft()):
+            res = self._get_result()
+            status = self.libpq.PQresultStatus(res)
+            if status in (PGRES_COMMAND_OK, PGRES_TUPLES_OK):
+                result.rowcounts.append(int(self.libpq.PQcmdTuples(res) or -1))
+            elif status == PGRES_PIPELINE_ABORTED:
+                result.rowcounts.append(None)
+            else:
+                result.errors.append((len(result.rowcounts), self._error(res)))
+                result.rowcounts.append(None)
+            self.libpq.PQclear(res)
+
+            # the results of every statement are terminated by a NULL
+            self._get_result()
+
+        res = self._get_result()
+        status = self.libpq.PQresultStatus(res)
+        self.libpq.PQclear(res)
+        if status != PGRES_PIPELINE_SYNC:
+            raise psycopg2.InterfaceError(
+                "unexpected result in pipeline: status %s" % status
+            )
+
+    def _get_result(self):
+        while self.libpq.PQisBusy(self.pgconn):
+            select.select([self.fileno], [], [])
+            if not self.libpq.PQconsumeInput(self.pgconn):
+                self._raise()
+        return self.libpq.PQgetResult(self.pgconn)
+
+    def _flush(self):
+        while True:
+            rv = self.libpq.PQflush(self.pgconn)
+            if rv == 0:
+                return
+            if rv < 0:
+                self._raise()
+            ready = select.select([self.fileno], [self.fileno], [])
+            if ready[0] and not self.libpq.PQconsumeInput(self.pgconn):
+                self._raise()
+
+    def _error(self, res):
+        msg = self.libpq.PQresultErrorMessage(res).decode(self.encoding, "replace")
+        sqlstate = self.libpq.PQresultErrorField(res, PG_DIAG_SQLSTATE)
+        try:
+            cls = psycopg2.errors.lookup(sqlstate.decode("ascii"))
+        except (AttributeError, KeyError):
+            cls = psycopg2.DatabaseError
+        return cls(msg)
+
+    def _raise(self):
+        msg = self.libpq.PQerrorMessage(self.pgconn)
+        raise psycopg2.OperationalError(msg.decode(self.encoding, "replace"))
+
+
+def execute_batch_pipeline(
+    cur, sql, argslist, page_size=100, max_pages=4, raise_errors=True
+):
+    """Like `~psycopg2.extras.execute_batch()`, using the libpq pipeline mode.
+
+    The statements are sent in pages of *page_size*, each followed by a sync
+    point, without waiting for the results of a page before sending the next
+    one: up to *max_pages* pages are in flight at the same time. Require libpq
+    14 or later.
+
+    Return a `PipelineResult` with the rowcount and the error of every
+    statement. If *raise_errors* is true, no other page is sent after an error
+    is received and the first error is raised at the end.
+
+    If a transaction must be started, the first statement is executed by the
+    cursor as usual, so that psycopg knows about the transaction.
+    """
+    conn = cur.connection
+    if conn.async_:
+        raise psycopg2.ProgrammingError(
+            "execute_batch_pipeline() can't be used on async connections"
+        )
+
+    result = PipelineResult()
+    argslist = iter(argslist)
+    if (
+        not conn.autocommit
+        and conn.info.transaction_status == ext.TRANSACTION_STATUS_IDLE
+    ):
+        for args in islice(argslist, 1):
+            cur.execute(sql, args)
+            result.rowcounts.append(cur.rowcount)
+
+    with _Pipeline(conn) as pipeline:
+        while not (raise_errors and result.errors):
+            page = [cur.mogrify(sql, args) for args in islice(argslist, page_size)]
+            if not page:
+                break
+            pipeline.send_page(page)
+            if len(pipeline.pending) >= max_pages:
+                pipeline.read_page(result)
+
+        while pipeline.pending:
+            pipeline.read_page(result)
+
+    if raise_errors and result.errors:
+        raise result.errors[0][1]
+
+    return result
+
+
+# Maximum number of statements prepared by `execute_batch_prepared()` on every
+# connection: the least recently used are deallocated to make room.
+prepared_cache_size = 100
+
+_prepared = weakref.WeakKeyDictionary()
+
+_re_placeholder = re.compile(rb"%(?:\(([^)]*)\))?(.)")
+
+
+class _PreparedStatements(object):
+    """The statements prepared on a connection, in LRU order."""
+
+    def __init__(self):
+        self.names = OrderedDict()
+        self.counter = 0
+
+    def get(self, key):
+        """Return the name of the statement *key*, None if not prepared."""
+        name = self.names.get(key)
+        if name is not None:
+            self.names.move_to_end(key)
+        return name
+
+    def new_name(self):
+        self.counter += 1
+        return ("_psycopg2_batch_%d" % self.counter).encode("ascii")
+
+    def evict(self, maxsize):
+        """Forget the statements exceeding *maxsize*; return their names."""
+        rv = []
+        while self.names and len(self.names) >= maxsize:
+            rv.append(self.names.popitem(last=False)[1])
+        return rv
+
+
+def forget_prepared(conn):
+    """Forget the statements prepared on *conn* by `execute_batch_prepared()`.
+
+    To be called if the statements are deallocated, e.g. by :sql:`DISCARD
+    ALL`.
+    """
+    _prepared.pop(conn, None)
+
+
+# The test pool deallocates the statements when it resets a connection
+ConnectionPool.add_reset_hook(forget_prepared)
+
+
+def _convert_placeholders(sql, numbered=True):
+    """Convert the psycopg placeholders in *sql* into positional ones.
+
+    If *numbered*, convert them into PostgreSQL ``$n`` parameters, otherwise
+    into ``%s`` placeholders, one for every occurrence of a named one.
+
+    Return the query, the number of parameters and the list of the parameters
+    names, or None if the placeholders are positional.
+    """
+    parts = []
+    names = None
+    nparams = 0
+    pos = 0
+    for m in _re_placeholder.finditer(sql):
+        parts.append(sql[pos : m.start()])
+        pos = m.end()
+        name, char = m.groups()
+        if char == b"%" and name is None:
+            parts.append(numbered and b"%" or b"%%")
+            continue
+        if char != b"s":
+            raise ValueError(
+                "unsupported format character: '%s'" % char.decode("ascii", "replace")
+            )
+
+        if name is None:
+            if names:
+                raise ValueError("can't mix positional and named placeholders")
+            nparams += 1
+            parts.append(numbered and b"$%d" % nparams or b"%s")
+        else:
+            if nparams and names is None:
+                raise ValueError("can't mix positional and named placeholders")
+            if names is None:
+                names = []
+            if not numbered:
+                names.append(name)
+                parts.append(b"%s")
+            else:
+                if name not in names:
+                    names.append(name)
+                parts.append(b"$%d" % (names.index(name) + 1))
+
+    parts.append(sql[pos:])
+    if names is not None:
+        return b"".join(parts), len(names), [n.decode("ascii") for n in names]
+    else:
+        return b"".join(parts), nparams, None
+
+
+def execute_batch_prepared(cur, sql, argslist, page_size=100):
+    """Like `~psycopg2.extras.execute_batch()`, using a prepared statement.
+
+    The first time *sql* is executed on a connection it is prepared on the
+    server; the pages then contain :sql:`EXECUTE` statements, which don't
+    need to be parsed and planned again. Up to `prepared_cache_size`
+    statements are kept prepared on every connection, deallocating the least
+    recently used ones.
+
+    *sql* may use positional or named placeholders; the latter require the
+    items of *argslist* to be mappings.
+    """
+    conn = cur.connection
+    if isinstance(sql, Composable):
+        sql = sql.as_string(cur)
+    if not isinstance(sql, bytes):
+        sql = sql.encode(ext.encodings[conn.encoding])
+
+    query, nparams, names = _convert_placeholders(sql)
+
+    stmts = _prepared.get(conn)
+    if stmts is None:
+        stmts = _prepared[conn] = _PreparedStatements()
+
+    name = stmts.get(sql)
+    if name is None:
+        # deallocate and prepare in the same round trip
+        cmds = [b"DEALLOCATE " + n for n in stmts.evict(prepared_cache_size)]
+        name = stmts.new_name()
+        cmds.append(b"PREPARE " + name + b" AS " + query)
+        cur.execute(b";".join(cmds))
+        stmts.names[sql] = name
+
+    if nparams:
+        template = b"EXECUTE " + name + b"(" + b",".join([b"%s"] * nparams) + b")"
+    else:
+        template = b"EXECUTE " + name
+
+    page = _PageBuffer(sep=b";")
+    for args in argslist:
+        if names is not None:
+            args = tuple(args[n] for n in names)
+        page.append(cur.mogrify(template, args))
+        if page.nitems >= page_size:
+            cur.execute(page.pop())
+
+    if page.nitems:
+        cur.execute(page.pop())
+
+
+# Encoders of Python values into the COPY binary format, by type oid.
+# The types missing here are loaded using the text format.
+_binary_encoders = {}
+
+_PG_EPOCH = dt.date(2000, 1, 1)
+_PG_EPOCH_TS = dt.datetime(2000, 1, 1)
+
+
+def _register_binary(oids, encoder):
+    for oid in oids:
+        _binary_encoders[oid] = encoder
+
+
+def _encode_timestamp(obj):
+    if obj.tzinfo is not None:
+        # the server would convert it to the session timezone, unknown here
+        raise ValueError(
+            "can't copy the timezone-aware %s into a timestamp column" % obj
+        )
+    delta = obj - _PG_EPOCH_TS
+    return struct.pack(
+        "!q", (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    )
+
+
+def _encode_date(obj):
+    if isinstance(obj, dt.datetime):
+        if obj.tzinfo is not None:
+            raise ValueError(
+                "can't copy the timezone-aware %s into a date column" % obj
+            )
+        obj = obj.date()
+    return struct.pack("!i", (obj - _PG_EPOCH).days)
+
+
+def _encode_uuid(obj):
+    if not isinstance(obj, uuid.UUID):
+        obj = uuid.UUID(str(obj))
+    return obj.bytes
+
+
+_register_binary([16], lambda obj: obj and b"\x01" or b"\x00")  # bool
+_register_binary([21], struct.Struct("!h").pack)  # int2
+_register_binary([23, 26], struct.Struct("!i").pack)  # int4, oid
+_register_binary([20], struct.Struct("!q").pack)  # int8
+_register_binary([700], struct.Struct("!f").pack)  # float4
+_register_binary([701], struct.Struct("!d").pack)  # float8
+_register_binary([17], bytes)  # bytea
+_register_binary([1082], _encode_date)  # date
+_register_binary([1114], _encode_timestamp)  # timestamp
+_register_binary([2950], _encode_uuid)  # uuid
+
+# text, varchar, bpchar, name: encoded in the connection encoding
+_TEXT_OIDS = (25, 1043, 1042, 19)
+
+
+def _text_repr(obj):
+    """Return the PostgreSQL text representation of the not null *obj*."""
+    if isinstance(obj, bool):
+        return obj and "t" or "f"
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        return "\\x" + bytes(obj).hex()
+    elif isinstance(obj, (dt.date, dt.time)):
+        return obj.isoformat()
+    elif isinstance(obj, dict):
+        return json.dumps(obj)
+    elif isinstance(obj, list):
+        return _array_repr(obj)
+    else:
+        return _str(obj)
+
+
+def _str(obj):
+    """Return ``str(obj)``, refusing the adapters which can't be unwrapped."""
+    if hasattr(obj, "getquoted"):
+        if isinstance(obj, Json):
+            return obj.dumps(obj.adapted)
+        # their output is a quoted SQL literal, not a COPY value
+        raise TypeError("can't copy %r: pass the value it adapts instead" % obj)
+    return str(obj)
+
+
+def _array_repr(obj):
+    """Return the array literal of the list *obj*, e.g. ``{1,NULL,"a b"}``."""
+    items = []
+    for item in obj:
+        if item is None:
+            items.append("NULL")
+        elif isinstance(item, list):
+            items.append(_array_repr(item))
+        else:
+            rv = _text_repr(item).replace("\\", "\\\\").replace('"', '\\"')
+            items.append('"' + rv + '"')
+    return "{" + ",".join(items) + "}"
+
+
+def _text_value(obj):
+    """Return the representation of *obj* as a field of a text COPY."""
+    return (
+        _text_repr(obj)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class _CopyValuesFile(object):
+    """A file-like object generating COPY data from a sequence of records."""
+
+    def __init__(self, rows, columns, encoders, encoding):
+        self.rows = iter(rows)
+        self.columns = columns
+        self.encoders = encoders
+        self.encoding = encoding
+        self.buffer = bytearray()
+        self.done = False
+        # the error raised by read(), which psycopg only reports as a string
+        self.error = None
+
+    def read(self, size=-1):
+        try:
+            self._fill(size)
+        except Exception as e:
+            self.error = e
+            raise
+
+        if size < 0:
+            size = len(self.buffer)
+        rv = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return rv
+
+    def _fill(self, size):
+        while not self.done and (size < 0 or len(self.buffer) < size):
+            row = next(self.rows, None)
+            if row is None:
+                self.done = True
+                self.finish()
+                break
+            if hasattr(row, "keys"):
+                row = [row[c] for c in self.columns]
+            elif len(row) != len(self.columns):
+                raise ValueError(
+                    "the record %r has %d values, %d columns expected"
+                    % (row, len(row), len(self.columns))
+                )
+            self.write_row(row)
+
+
+class _BinaryCopyFile(_CopyValuesFile):
+    def __init__(self, *args):
+        super(_BinaryCopyFile, self).__init__(*args)
+        # signature, flags, header extension length
+        self.buffer += b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+        self.row_header = struct.pack("!h", len(self.columns))
+
+    def write_row(self, row):
+        buf = self.buffer
+        buf += self.row_header
+        for obj, encoder in zip(row, self.encoders):
+            if obj is None:
+                buf += b"\xff\xff\xff\xff"
+            else:
+                data = encoder(obj)
+                buf += struct.pack("!i", len(data))
+                buf += data
+
+    def finish(self):
+        self.buffer += b"\xff\xff"
+
+
+class _TextCopyFile(_CopyValuesFile):
+    def write_row(self, row):
+        fields = [obj is None and "\\N" or _text_value(obj) for obj in row]
+        self.buffer += ("\t".join(fields) + "\n").encode(self.encoding)
+
+    def finish(self):
+        pass
+
+
+def _column_types(cur, table, columns):
+    """Return the oids of the *columns* of *table*, resolving domains."""
+    cur.execute(
+        """
+        select a.attname, coalesce(nullif(t.typbasetype, 0), t.oid)
+        from pg_attribute a join pg_type t on t.oid = a.atttypid
+        where a.attrelid = %s::regclass and a.attname = any(%s)
+        and a.attnum > 0 and not a.attisdropped""",
+        (table.as_string(cur), list(columns)),
+    )
+    types = dict(cur.fetchall())
+    missing = [c for c in columns if c not in types]
+    if missing:
+        raise psycopg2.ProgrammingError(
+            "columns not found in %s: %s" % (table.as_string(cur), ", ".join(missing))
+        )
+    return [types[c] for c in columns]
+
+
+def copy_values(cur, table, columns, argslist, size=8192):
+    """Load the records in *argslist* into *table* using :sql:`COPY`.
+
+    The records may be sequences, with the values of *columns* in order, or
+    mappings with *columns* as keys. *table* may be a name or a `sql`
+    object.
+
+    The data is sent in the binary format if all the columns types can be
+    encoded, otherwise in text format. The records are converted while
+    *argslist* is consumed, in chunks of about *size* bytes. The values must
+    be plain Python objects: of the adapter wrappers only
+    `~psycopg2.extras.Json` is accepted.
+
+    Timezone-aware datetimes can't be loaded into :sql:`timestamp` or
+    :sql:`date` columns, because the server would convert them to its session
+    timezone: convert them to naive datetimes first, or load them into a
+    :sql:`timestamptz` column.
+
+    An exception raised by *argslist*, or by a record which can't be
+    converted, is raised as is, after the server has aborted the copy.
+    """
+    conn = cur.connection
+    if not isinstance(table, Composable):
+        table = pgsql.Identifier(table)
+    columns = list(columns)
+    encoding = ext.encodings[conn.encoding]
+
+    encoders = []
+    for oid in _column_types(cur, table, columns):
+        if oid in _TEXT_OIDS:
+            encoders.append(lambda obj: _str(obj).encode(encoding))
+        else:
+            encoders.append(_binary_encoders.get(oid))
+
+    if None in encoders:
+        f = _TextCopyFile(argslist, columns, None, encoding)
+        options = pgsql.SQL("")
+    else:
+        f = _BinaryCopyFile(argslist, columns, encoders, encoding)
+        options = pgsql.SQL(" (format binary)")
+
+    stmt = pgsql.SQL("copy {} ({}) from stdin{}").format(
+        table, pgsql.SQL(", ").join(map(pgsql.Identifier, columns)), options
+    )
+    try:
+        cur.copy_expert(stmt, f, size=size)
+    except psycopg2.Error:
+        if f.error is not None:
+            raise f.error
+        raise
+
+
+_STOP = object()
+_ABORT = object()
+
+
+class _LoadAborted(Exception):
+    """Raised in the loading threads when the load is interrupted."""
+
+
+class _LoadWorker(threading.Thread):
+    """A thread loading on a connection the rows it receives on a queue."""
+
+    def __init__(self, conn, load, queue_size, xid=None):
+        super(_LoadWorker, self).__init__()
+        self.daemon = True
+        self.conn = conn
+        self.load = load
+        self.xid = xid
+        self.queue = queue.Queue(queue_size)
+        self.nrows = 0
+        self.error = None
+        self.stopped = False
+        self.aborted = False
+
+    def run(self):
+        try:
+            if self.xid is not None:
+                self.conn.tpc_begin(self.xid)
+            self.load(self.conn.cursor(), self.rows())
+            # make sure to wait for the end of the data, or the abort signal
+            for row in self.rows():
+                pass
+            if self.xid is not None:
+                self.conn.tpc_prepare()
+        except Exception as e:
+            # After an abort the load fails in whatever way the abort surfaced
+            # (e.g. as QueryCanceled, in a COPY): it is not an error to report.
+            if not self.aborted:
+                self.error = e
+            # don't leave the producer blocked on a full queue
+            try:
+                for row in self.rows():
+                    pass
+            except _LoadAborted:
+                pass
+
+    def finish(self, commit):
+        """Terminate the transaction of the thread, after it has finished."""
+        if commit:
+            if self.xid is not None:
+                self.conn.tpc_commit()
+            else:
+                self.conn.commit()
+        else:
+            try:
+                if self.xid is not None:
+                    self.conn.tpc_rollback()
+                else:
+                    self.conn.rollback()
+            except psycopg2.Error:
+                pass
+
+    def rows(self):
+        """Yield the rows received until the end of the data."""
+        while not self.stopped:
+            batch = self.queue.get()
+            if batch is _STOP or batch is _ABORT:
+                self.stopped = True
+                if batch is _ABORT:
+                    self.aborted = True
+                    raise _LoadAborted()
+                break
+            self.nrows += len(batch)
+            for row in batch:
+                yield row
+
+
+def parallel_load(
+    connections,
+    load,
+    argslist,
+    key=None,
+    workers=4,
+    tpc=False,
+    batch_size=1000,
+    queue_size=10,
+):
+    """Load the records in *argslist* on several connections in parallel.
+
+    *connections* is a list of connections or a connection string, in which
+    case *workers* connections are opened, and closed at the end.
+
+    *load* is a function ``load(cur, rows)`` loading the iterable *rows*
+    using the cursor *cur*, e.g. calling `~psycopg2.extras.execute_values()`
+    or `copy_values()`; it is called by a thread for each connection, in its
+    own transaction, which is terminated once all the threads have finished.
+
+    The records are distributed to the connections according to the hash of
+    ``key(record)``, so that records with the same key are loaded by the same
+    connection, or round robin if *key* is None. They are sent to the threads
+    in batches of *batch_size*, with at most *queue_size* batches waiting for
+    every thread.
+
+    If a connection fails, or *argslist* raises an exception, all the
+    transactions are rolled back and the first error is raised. Otherwise
+    the transactions are committed: if *tpc* is true they are two-phase
+    ones, committed only once all of them are prepared; without *tpc* a
+    failure while committing may leave some of them committed.
+
+    Return the number of records loaded by each connection.
+    """
+    if isinstance(connections, str):
+        conns = [psycopg2.connect(connections) for i in range(workers)]
+    else:
+        conns = list(connections)
+
+    gtrid = uuid.uuid4().hex if tpc else None
+    threads = [
+        _LoadWorker(
+            conn,
+            load,
+            queue_size,
+            xid=conn.xid(1, gtrid, str(i)) if tpc else None,
+        )
+        for i, conn in enumerate(conns)
+    ]
+    for t in threads:
+        t.start()
+
+    ok = False
+    try:
+        ok = _distribute(threads, argslist, key, batch_size)
+    finally:
+        for t in threads:
+            t.queue.put(_STOP if ok else _ABORT)
+        for t in threads:
+            t.join()
+
+        errors = [t.error for t in threads if t.error is not None]
+        try:
+            for t in threads:
+                t.finish(ok and not errors)
+        finally:
+            if isinstance(connections, str):
+                for conn in conns:
+                    conn.close()
+
+    if errors:
+        raise errors[0]
+
+    return [t.nrows for t in threads]
+
+
+def _distribute(threads, argslist, key, batch_size):
+    """Send the records to the threads; return False if any of them failed."""
+    nthreads = len(threads)
+    batches = [[] for t in threads]
+    for i, args in enumerate(argslist):
+        if key is not None:
+            n = hash(key(args)) % nthreads
+        else:
+            n = (i // batch_size) % nthreads
+        batch = batches[n]
+        batch.append(args)
+        if len(batch) >= batch_size:
+            threads[n].queue.put(batch)
+            batches[n] = []
+            if any(t.error is not None for t in threads):
+                return False
+
+    for t, batch in zip(threads, batches):
+        if batch:
+            t.queue.put(batch)
+
+    return not any(t.error is not None for t in threads)
+
+
+# Maximum number of plans kept by `execute_values_compiled()`
+values_plan_cache_size = 128
+
+_values_plans = OrderedDict()
+_values_plans_lock = threading.Lock()
+
+
+class _ValuesPlan(object):
+    """An `execute_values()` query and template, parsed once.
+
+    The statement of a page is built from the *pre* and *post* snippets of the
+    query and the row template repeated, with positional placeholders only, so
+    that it can be merged with all the values of the page by a single
+    `~cursor.mogrify()`. `names` is the order of the fields to take from
+    mappings, None if the records are sequences. If *template* is None the
+    number of values of the records is sniffed from the first one, as
+    `!execute_values()` does.
+    """
+
+    def __init__(self, pre, post, template=None, sep=b","):
+        # pre and post are unescaped by _split_sql: they go through mogrify
+        self.pre = b"".join(pre).replace(b"%", b"%%")
+        self.post = b"".join(post).replace(b"%", b"%%")
+        self.sep = sep.replace(b"%", b"%%")
+        self.names = None
+        self.template = template
+        self.nparams = None
+        if template is not None:
+            self.template, self.nparams, self.names = _convert_placeholders(
+                template, numbered=False
+            )
+        self._pages = {}
+
+    def width(self, first):
+        """Return the number of values of the records, given the *first* one."""
+        if self.nparams is not None:
+            return self.nparams
+        else:
+            return len(first)
+
+    def page_template(self, nrows, width):
+        """Return the template of a statement with *nrows* records."""
+        key = nrows, width
+        rv = self._pages.get(key)
+        if rv is None:
+            template = self.template or b"(" + b",".join([b"%s"] * width) + b")"
+            rv = self.pre + self.sep.join([template] * nrows) + self.post
+            # usually only page_size and the last page length
+            if len(self._pages) < 4:
+                self._pages[key] = rv
+        return rv
+
+    def values(self, page, width):
+        """Return the values of the records in *page* as a flat list.
+
+        Raise `!TypeError` if a sequence record doesn't have *width* values,
+        or if a record is a mapping but the template has no names: merged in a
+        single list, they would shift the values into the other records.
+        """
+        rv = []
+        if self.names is None:
+            for args in page:
+                if isinstance(args, Mapping):
+                    raise TypeError(
+                        "a template with named placeholders is required"
+                        " for mapping records"
+                    )
+                if len(args) != width:
+                    raise TypeError(
+                        "record has %d values, %d expected" % (len(args), width)
+                    )
+                rv.extend(args)
+        else:
+            names = self.names
+            for args in page:
+                rv.extend([args[n] for n in names])
+        return rv
+
+
+def _get_values_plan(cur, sql, template, sep=b","):
+    if isinstance(sql, Composable):
+        sql = sql.as_string(cur)
+    encoding = ext.encodings[cur.connection.encoding]
+    if not isinstance(sql, bytes):
+        sql = sql.encode(encoding)
+    if isinstance(template, Composable):
+        template = template.as_string(cur)
+    if template is not None and not isinstance(template, bytes):
+        template = template.encode(encoding)
+    if not isinstance(sep, bytes):
+        sep = sep.encode(encoding)
+
+    key = (sql, template, sep)
+    with _values_plans_lock:
+        plan = _values_plans.get(key)
+        if plan is not None:
+            _values_plans.move_to_end(key)
+            return plan
+
+    pre, post = _split_sql(sql)
+    plan = _ValuesPlan(pre, post, template, sep)
+    with _values_plans_lock:
+        _values_plans[key] = plan
+        while len(_values_plans) > values_plan_cache_size:
+            _values_plans.popitem(last=False)
+
+    return plan
+
+
+def execute_values_compiled(
+    cur, sql, argslist, template=None, page_size=100, fetch=False
+):
+    """Like `~psycopg2.extras.execute_values()`, parsing the query only once.
+
+    The query and the template are parsed the first time they are used and
+    the result is kept in a cache of `values_plan_cache_size` entries. Every
+    page of records is merged into the statement with a single call to
+    `~cursor.mogrify()`, instead of one per record.
+    """
+    plan = _get_values_plan(cur, sql, template)
+    width = None
+    result = [] if fetch else None
+    argslist = iter(argslist)
+    while True:
+        page = list(islice(argslist, page_size))
+        if not page:
+            break
+        if width is None:
+            width = plan.width(page[0])
+        cur.execute(
+            cur.mogrify(plan.page_template(len(page), width), plan.values(page, width))
+        )
+        if fetch:
+            result.extend(cur.fetchall())
+
+    return result
+
+
+def mogrify_many(cur, template, argslist, sep=b","):
+    """Merge every record of *argslist* into *template*, joined by *sep*.
+
+    Return the `!bytes` a loop of `~cursor.mogrify()` calls would produce and
+    join, building them with a single call over all the values instead. The
+    template is parsed once and cached as in `execute_values_compiled()`; it
+    can use ``%s`` placeholders with sequences or ``%(name)s`` with mappings.
+    Raise `!TypeError` if a record doesn't match the template, as `!mogrify()`
+    would.
+    """
+    argslist = list(argslist)
+    if not argslist:
+        return b""
+    plan = _get_values_plan(cur, b"%s", template, sep)
+    width = plan.width(argslist[0])
+    return cur.mogrify(
+        plan.page_template(len(argslist), width), plan.values(argslist, width)
+    )
+
+
+def _row_repr(self):
+    return "%s(%s)" % (
+        type(self).__name__,
+        ", ".join("%s=%r" % item for item in zip(self._fields, self)),
+    )
+
+
+def _row_asdict(self):
+    return dict(zip(self._fields, self))
+
+
+def make_row_class(names, name="Record"):
+    """Return a `!tuple` subclass exposing its items as the attributes *names*.
+
+    The names are cleaned up as `!NamedTupleCursor` does. The class is built
+    with `!type()` rather than generated code, and it has no `!__new__()`: the
+    records are created calling it with a tuple, entirely in C.
+    """
+    fields = []
+    for s in names:
+        s = _re_clean.sub("_", s)
+        # same as NamedTupleCursor, so that the attributes are the same
+        if s[0] == "_" or "0" <= s[0] <= "9":
+            s = "f" + s
+        fields.append(s)
+
+    ns = {
+        "__slots__": (),
+        "_fields": tuple(fields),
+        "__repr__": _row_repr,
+        "_asdict": _row_asdict,
+    }
+    for i, field in enumerate(fields):
+        ns[field] = property(itemgetter(i), doc="Alias for field number %d" % i)
+
+    return type(name, (tuple,), ns)
+
+
+CacheInfo = namedtuple("CacheInfo", "hits misses evictions maxsize currsize")
+
+
+class RecordClassCache(object):
+    """A LRU cache of the record classes of the named tuple cursors.
+
+    The classes are keyed by the cursor class and by the names and types of
+    the columns, so the cache can be shared by different connections. The
+    cache is thread-safe. *maxsize* can be None to never evict classes.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = self.misses = self.evictions = 0
+        self._classes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, make):
+        """Return the class for *key*, calling *make(key)* if not cached."""
+        with self._lock:
+            rv = self._classes.get(key)
+            if rv is not None:
+                self.hits += 1
+                self._classes.move_to_end(key)
+                return rv
+
+            self.misses += 1
+            rv = make(key)
+            if self.maxsize is None or self.maxsize > 0:
+                self._classes[key] = rv
+                self._evict()
+            return rv
+
+    def resize(self, maxsize):
+        """Change the size of the cache, evicting the classes in excess."""
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        """Empty the cache and reset its counters."""
+        with self._lock:
+            self._classes.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def cache_info(self):
+        """Return the counters of the cache as a `CacheInfo` tuple."""
+        with self._lock:
+            return CacheInfo(
+                self.hits,
+                self.misses,
+                self.evictions,
+                self.maxsize,
+                len(self._classes),
+            )
+
+    def _evict(self):
+        if self.maxsize is None:
+            return
+        while len(self._classes) > self.maxsize:
+            self._classes.popitem(last=False)
+            self.evictions += 1
+
+
+# The cache used by the connections without one of their own
+record_class_cache = RecordClassCache()
+
+_record_class_caches = weakref.WeakKeyDictionary()
+
+
+def set_record_class_cache(conn, cache):
+    """Make the cursors of *conn* use *cache* for their record classes.
+
+    Pass None to go back to the global `record_class_cache`.
+    """
+    if cache is None:
+        _record_class_caches.pop(conn, None)
+    else:
+        _record_class_caches[conn] = cache
+
+
+def get_record_class_cache(conn):
+    """Return the `RecordClassCache` used by the cursors of *conn*."""
+    return _record_class_caches.get(conn, record_class_cache)
+
+
+class CachedNamedTupleCursor(NamedTupleCursor):
+    """A `!NamedTupleCursor` whose classes are kept in a `RecordClassCache`.
+
+    The cache is the one returned by `get_record_class_cache()` for the
+    cursor connection, and the classes are keyed by the columns names and
+    types, not by the names only.
+    """
+
+    def _make_nt(self):
+        desc = self.description or ()
+        cols = tuple((d[0], d[1]) for d in desc)
+        cache = get_record_class_cache(self.connection)
+        return cache.get((type(self), cols), self._make_cached_nt)
+
+    @classmethod
+    def _make_cached_nt(cls, key):
+        return cls._do_make_nt(tuple(name for name, oid in key[1]))
+
+
+class CompactNamedTupleCursor(CachedNamedTupleCursor):
+    """A `!NamedTupleCursor` returning records of `make_row_class()` classes.
+
+    The classes are cached as the `CachedNamedTupleCursor` ones, and the
+    records are built directly from the tuples fetched, without `!_make()`.
+    """
+
+    def fetchone(self):
+        t = super(NamedTupleCursor, self).fetchone()
+        if t is not None:
+            nt = self.Record
+            if nt is None:
+                nt = self.Record = self._make_nt()
+            return nt(t)
+
+    def fetchmany(self, size=None):
+        ts = super(NamedTupleCursor, self).fetchmany(size)
+        nt = self.Record
+        if nt is None:
+            nt = self.Record = self._make_nt()
+        return list(map(nt, ts))
+
+    def fetchall(self):
+        ts = super(NamedTupleCursor, self).fetchall()
+        nt = self.Record
+        if nt is None:
+            nt = self.Record = self._make_nt()
+        return list(map(nt, ts))
+
+    def __iter__(self):
+        it = super(NamedTupleCursor, self).__iter__()
+        try:
+            t = next(it)
+        except StopIteration:
+            return
+
+        nt = self.Record
+        if nt is None:
+            nt = self.Record = self._make_nt()
+
+        yield nt(t)
+        for t in it:
+            yield nt(t)
+
+    @classmethod
+    def _do_make_nt(cls, key):
+        return make_row_class(key)
+
+
+class CompactNamedTupleConnection(NamedTupleConnection):
+    """A connection that uses `CompactNamedTupleCursor` automatically."""
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault(
+            "cursor_factory", self.cursor_factory or CompactNamedTupleCursor
+        )
+        return super(CompactNamedTupleConnection, self).cursor(*args, **kwargs)
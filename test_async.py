@@ -31,7 +31,7 @@ import psycopg2
 import psycopg2.errors
 from psycopg2 import extensions as ext
 
-from .testutils import ConnectingTestCase, skip_before_postgres, slow
+from .testutils import ConnectingTestCase, Waiter, skip_before_postgres, slow
 
 
 class PollableStub(object):
@@ -240,6 +240,50 @@ class AsyncTests(ConnectingTestCase):
         else:
             self.fail("No notification received")
 
+    @slow
+    def test_wait_all(self):
+        waiter = Waiter()
+        conns = [self.connect(async_=True) for i in range(3)]
+        waiter.wait_all(conns)
+        for conn in conns:
+            self.assert_(not conn.isexecuting())
+        self.assert_(waiter.polls >= 3)
+
+        # the queries run concurrently
+        curs = [conn.cursor() for conn in conns]
+        for i, cur in enumerate(curs):
+            cur.execute("select pg_sleep(0.2), %s", (i,))
+        waiter = Waiter()
+        t0 = time.time()
+        waiter.wait_all(curs)
+        self.assert_(time.time() - t0 < 0.5)
+        self.assertEqual([cur.fetchone()[1] for cur in curs], [0, 1, 2])
+
+        self.assert_(waiter.polls >= 6, waiter.polls)
+        self.assert_(0.1 < waiter.blocked < 0.5, waiter.blocked)
+
+    def test_wait_all_same_connection(self):
+        # a cursor is waited for through its connection, only once
+        cur = self.conn.cursor()
+        cur.execute("select 1")
+        waiter = Waiter()
+        waiter.wait_all([cur, self.conn])
+        self.assertEqual(cur.fetchone(), (1,))
+        self.assert_(waiter.polls >= 1)
+
+    def test_wait_all_error(self):
+        conn = self.connect(async_=True)
+        self.wait(conn)
+        cur1 = self.conn.cursor()
+        cur2 = conn.cursor()
+        cur1.execute("select 1 / 0")
+        cur2.execute("select 42")
+        self.assertRaises(psycopg2.errors.DivisionByZero, self.wait_all, [cur1, cur2])
+
+        # the other connection can still complete its query
+        self.wait(cur2)
+        self.assertEqual(cur2.fetchone(), (42,))
+
 
 def test_suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
@@ -475,13 +475,13 @@ class ConnectionTwoPhaseTests(ConnectingTestCase):
             )
         except psycopg2.ProgrammingError:
             cnn.rollback()
-            cnn.close()
+            self.release(cnn)
             return
 
         gids = [r[0] for r in cur]
         for gid in gids:
             cur.execute("rollback prepared %s;", (gid,))
-        cnn.close()
+        self.release(cnn)
 
     def make_test_table(self):
         cnn = self.connect()
@@ -492,7 +492,7 @@ class ConnectionTwoPhaseTests(ConnectingTestCase):
             cnn.rollback()
         cur.execute("CREATE TABLE test_tpc (data text);")
         cnn.commit()
-        cnn.close()
+        self.release(cnn)
 
     def count_xacts(self):
         """Return the number of prepared xacts currently in the test db."""
@@ -505,7 +505,7 @@ class ConnectionTwoPhaseTests(ConnectingTestCase):
             (dbname,),
         )
         rv = cur.fetchone()[0]
-        cnn.close()
+        self.release(cnn)
         return rv
 
     def count_test_records(self):
@@ -514,7 +514,7 @@ class ConnectionTwoPhaseTests(ConnectingTestCase):
         cur = cnn.cursor()
         cur.execute("select count(*) from test_tpc;")
         rv = cur.fetchone()[0]
-        cnn.close()
+        self.release(cnn)
         return rv
 
     def test_tpc_commit(self):
@@ -838,6 +838,28 @@ class TransactionControlTests(ConnectingTestCase):
             ext.ISOLATION_LEVEL_SERIALIZABLE,
         )
 
+    @skip_before_postgres(9, 1)
+    def test_set_session_roundtrips(self):
+        # the session characteristics are sent together with BEGIN
+        cur = self.conn.cursor()
+        with self.trace(self.conn) as trace:
+            self.conn.set_session(
+                ext.ISOLATION_LEVEL_SERIALIZABLE, readonly=True, deferrable=True
+            )
+        self.assertEqual(trace.messages, [])
+
+        with self.trace(self.conn) as trace:
+            cur.execute("select 1")
+        # BEGIN and the statement, no SET before them
+        self.assertEqual(trace.count("Query", "F"), 2)
+        self.assertEqual(trace.count("ReadyForQuery", "B"), 2)
+
+        cur.execute("show transaction_isolation")
+        self.assertEqual(cur.fetchone()[0], "serializable")
+        cur.execute("show transaction_read_only")
+        self.assertEqual(cur.fetchone()[0], "on")
+        self.conn.rollback()
+
     def test_set_isolation_level(self):
         cur = self.conn.cursor()
         self.conn.set_session(ext.ISOLATION_LEVEL_SERIALIZABLE)
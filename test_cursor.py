@@ -32,6 +32,7 @@ from .testutils import (
     skip_before_postgres,
     skip_if_no_superuser,
     skip_if_windows,
+    shared_table,
 )
 
 import psycopg2.extras
@@ -39,15 +40,8 @@ import psycopg2.extras
 
 class CursorTests(ConnectingTestCase):
     def _create_withhold_table(self):
-        curs = self.conn.cursor()
-        try:
-            curs.execute("drop table withhold")
-        except psycopg2.ProgrammingError:
-            self.conn.rollback()
-        curs.execute("create table withhold (data int)")
-        for i in (10, 20, 30):
-            curs.execute("insert into withhold values (%s)", (i,))
-        curs.close()
+        # the tests only read from the table
+        shared_table("withhold", "data int", [(10,), (20,), (30,)])
 
     def test_withhold(self):
         self.assertRaises(psycopg2.ProgrammingError, self.conn.cursor, withhold=True)
@@ -68,10 +62,6 @@ class CursorTests(ConnectingTestCase):
         self.conn.commit()
         self.assertEqual(curs.fetchall(), [(10,), (20,), (30,)])
 
-        curs = self.conn.cursor()
-        curs.execute("drop table withhold")
-        self.conn.commit()
-
     def test_withhold_no_begin(self):
         self._create_withhold_table()
         curs = self.conn.cursor("w", withhold=True)
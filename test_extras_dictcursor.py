@@ -32,6 +32,8 @@ from .testutils import (
     skip_before_python,
     skip_from_python,
 )
+from . import fastextras
+from .fastextras import CompactNamedTupleConnection, CompactNamedTupleCursor
 
 
 class _DictCursorBase(ConnectingTestCase):
@@ -702,6 +704,212 @@ class NamedTupleCursorTest(ConnectingTestCase):
             NamedTupleCursor._cached_make_nt = old_func
 
 
+class CompactNamedTupleCursorTest(NamedTupleCursorTest):
+    # Run all the NamedTupleCursor tests on the compact records too
+    def setUp(self):
+        ConnectingTestCase.setUp(self)
+
+        self.conn = self.connect(connection_factory=CompactNamedTupleConnection)
+        curs = self.conn.cursor()
+        curs.execute("CREATE TEMPORARY TABLE nttest (i int, s text)")
+        curs.execute("INSERT INTO nttest VALUES (1, 'foo')")
+        curs.execute("INSERT INTO nttest VALUES (2, 'bar')")
+        curs.execute("INSERT INTO nttest VALUES (3, 'baz')")
+        self.conn.commit()
+
+    def test_cursor_factory(self):
+        curs = self.conn.cursor()
+        self.assert_(isinstance(curs, CompactNamedTupleCursor))
+        curs.execute("select * from nttest order by 1")
+        t = curs.fetchone()
+        self.assert_(isinstance(t, tuple))
+        # the records are built without _make()
+        self.assert_(not hasattr(t, "_make"))
+        self.assertEqual(t, (1, "foo"))
+
+    def test_record(self):
+        curs = self.conn.cursor()
+        curs.execute("select 1 as foo, 'x' as \"foo.bar\"")
+        t = curs.fetchone()
+        self.assertEqual(t._fields, ("foo", "foo_bar"))
+        self.assertEqual(repr(t), "Record(foo=1, foo_bar='x')")
+        self.assertEqual(t._asdict(), {"foo": 1, "foo_bar": "x"})
+        self.assertRaises(AttributeError, setattr, t, "foo", 2)
+        self.assertRaises(AttributeError, setattr, t, "baz", 2)
+
+    def test_cache_separate(self):
+        curs = self.conn.cursor()
+        curs.execute("select 10 as a, 20 as b")
+        r1 = curs.fetchone()
+
+        curs = self.conn.cursor(cursor_factory=NamedTupleCursor)
+        curs.execute("select 10 as a, 20 as b")
+        r2 = curs.fetchone()
+
+        self.assert_(type(r1) is not type(r2))
+        self.assert_(hasattr(r2, "_make"))
+
+    # The compact cursor uses a RecordClassCache instead of the lru_cache
+
+    def test_minimal_generation(self):
+        f_orig = CompactNamedTupleCursor._make_nt
+        calls = [0]
+
+        def f_patched(self_):
+            calls[0] += 1
+            return f_orig(self_)
+
+        CompactNamedTupleCursor._make_nt = f_patched
+
+        try:
+            curs = self.conn.cursor()
+            curs.execute("select * from nttest order by 1")
+            curs.fetchone()
+            curs.fetchone()
+            curs.fetchone()
+            self.assertEqual(1, calls[0])
+
+            curs.execute("select * from nttest order by 1")
+            curs.fetchone()
+            curs.fetchall()
+            self.assertEqual(2, calls[0])
+
+        finally:
+            del CompactNamedTupleCursor._make_nt
+
+    def test_cache(self):
+        cache = fastextras.RecordClassCache()
+        fastextras.set_record_class_cache(self.conn, cache)
+
+        curs = self.conn.cursor()
+        curs.execute("select 10 as a, 20 as b")
+        r1 = curs.fetchone()
+        curs.execute("select 10 as a, 20 as c")
+        r2 = curs.fetchone()
+
+        # Get a new cursor to check that the cache works across multiple ones
+        curs = self.conn.cursor()
+        curs.execute("select 10 as a, 30 as b")
+        r3 = curs.fetchone()
+
+        self.assert_(type(r1) is type(r3))
+        self.assert_(type(r1) is not type(r2))
+
+        cache_info = cache.cache_info()
+        self.assertEqual(cache_info.hits, 1)
+        self.assertEqual(cache_info.misses, 2)
+        self.assertEqual(cache_info.evictions, 0)
+        self.assertEqual(cache_info.currsize, 2)
+
+    def test_max_cache(self):
+        cache = fastextras.RecordClassCache(8)
+        fastextras.set_record_class_cache(self.conn, cache)
+
+        recs = []
+        curs = self.conn.cursor()
+        for i in range(10):
+            curs.execute("select 1 as f%s" % i)
+            recs.append(curs.fetchone())
+
+        # Still in cache
+        curs.execute("select 1 as f9")
+        rec = curs.fetchone()
+        self.assert_(any(type(r) is type(rec) for r in recs))
+
+        # Gone from cache
+        curs.execute("select 1 as f0")
+        rec = curs.fetchone()
+        self.assert_(all(type(r) is not type(rec) for r in recs))
+
+        self.assertEqual(cache.cache_info().evictions, 3)
+
+    def test_cache_types(self):
+        cache = fastextras.RecordClassCache()
+        fastextras.set_record_class_cache(self.conn, cache)
+
+        curs = self.conn.cursor()
+        curs.execute("select 10 as a")
+        r1 = curs.fetchone()
+        curs.execute("select 'x'::text as a")
+        r2 = curs.fetchone()
+        curs.execute("select 20 as a")
+        r3 = curs.fetchone()
+
+        self.assert_(type(r1) is not type(r2))
+        self.assert_(type(r1) is type(r3))
+        self.assertEqual(cache.cache_info().misses, 2)
+
+    def test_cache_shared(self):
+        cache = fastextras.RecordClassCache()
+        conn2 = self.connect(connection_factory=CompactNamedTupleConnection)
+        fastextras.set_record_class_cache(self.conn, cache)
+        fastextras.set_record_class_cache(conn2, cache)
+
+        curs = self.conn.cursor()
+        curs.execute("select 10 as a, 20 as b")
+        r1 = curs.fetchone()
+        curs = conn2.cursor()
+        curs.execute("select 10 as a, 20 as b")
+        r2 = curs.fetchone()
+
+        self.assert_(type(r1) is type(r2))
+        self.assertEqual(cache.cache_info().hits, 1)
+
+    def test_global_cache(self):
+        cache = fastextras.record_class_cache
+        self.assert_(fastextras.get_record_class_cache(self.conn) is cache)
+
+        fastextras.set_record_class_cache(self.conn, fastextras.RecordClassCache())
+        self.assert_(fastextras.get_record_class_cache(self.conn) is not cache)
+        fastextras.set_record_class_cache(self.conn, None)
+        self.assert_(fastextras.get_record_class_cache(self.conn) is cache)
+
+        misses = cache.cache_info().misses
+        curs = self.conn.cursor()
+        curs.execute("select 10 as a, 20 as b, 30 as global_cache")
+        curs.fetchone()
+        self.assertEqual(cache.cache_info().misses, misses + 1)
+
+
+class RecordClassCacheTest(unittest.TestCase):
+    def test_lru(self):
+        cache = fastextras.RecordClassCache(2)
+        a = cache.get("a", list)
+        cache.get("b", list)
+        self.assert_(cache.get("a", list) is a)
+        cache.get("c", list)
+        self.assertEqual(cache.cache_info(), (1, 3, 1, 2, 2))
+
+        # b was the least recently used
+        self.assert_(cache.get("a", list) is a)
+        cache.get("b", list)
+        self.assertEqual(cache.cache_info(), (2, 4, 2, 2, 2))
+
+    def test_resize(self):
+        cache = fastextras.RecordClassCache(4)
+        for key in "abcd":
+            cache.get(key, list)
+        cache.resize(1)
+        self.assertEqual(cache.cache_info(), (0, 4, 3, 1, 1))
+
+        cache.resize(None)
+        for key in "efgh":
+            cache.get(key, list)
+        self.assertEqual(cache.cache_info(), (0, 8, 3, None, 5))
+
+    def test_no_cache(self):
+        cache = fastextras.RecordClassCache(0)
+        self.assert_(cache.get("a", list) is not cache.get("a", list))
+        self.assertEqual(cache.cache_info(), (0, 2, 0, 0, 0))
+
+    def test_clear(self):
+        cache = fastextras.RecordClassCache()
+        cache.get("a", list)
+        cache.get("a", list)
+        cache.clear()
+        self.assertEqual(cache.cache_info(), (0, 0, 0, 1024, 0))
+
+
 def test_suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
 
@@ -15,7 +15,8 @@
 # FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
 # License for more details.
 
-from datetime import date
+from datetime import date, datetime
+from decimal import Decimal
 
 from . import testutils
 import unittest
@@ -24,6 +25,9 @@ import psycopg2
 import psycopg2.extras
 import psycopg2.extensions as ext
 from psycopg2 import sql
+from psycopg2.tz import FixedOffsetTimezone
+
+from . import fastextras
 
 
 class TestPaginate(unittest.TestCase):
@@ -45,14 +49,122 @@ class TestPaginate(unittest.TestCase):
         )
 
 
+class TestPageBuffer(unittest.TestCase):
+    def test_pages(self):
+        page = fastextras._PageBuffer([b"insert ", b"x"], [b" returning", b" id"])
+        self.assertEqual(page.nbytes, len(b"insert x returning id"))
+        page.append(b"(1)")
+        page.append(b"(2)")
+        self.assertEqual(page.nitems, 2)
+        self.assertEqual(page.nbytes, len(b"insert x(1),(2) returning id"))
+        self.assertEqual(page.pop(), b"insert x(1),(2) returning id")
+        self.assertEqual(page.nitems, 0)
+        page.append(b"(3)")
+        self.assertEqual(page.pop(), b"insert x(3) returning id")
+
+    def test_reuse(self):
+        page = fastextras._PageBuffer(sep=b";")
+        buf = page.buf
+        for i in range(3):
+            page.append(b"select 1")
+            page.append(b"select 2")
+            self.assertEqual(page.pop(), b"select 1;select 2")
+        self.assert_(page.buf is buf)
+
+
+class TestPageSizer(unittest.TestCase):
+    def test_grow(self):
+        sizer = fastextras.PageSizer(10, max_bytes=1000, target_time=1.0)
+        self.assert_(not sizer.full(9, 100))
+        self.assert_(sizer.full(10, 100))
+        sizer.update(10, 100, 0.1)
+        self.assertEqual(sizer.page_size, 20)
+        sizer.update(20, 200, 0.6)
+        self.assertEqual(sizer.page_size, 20)
+        self.assertEqual(sizer.sizes, [10, 20])
+
+    def test_shrink(self):
+        sizer = fastextras.PageSizer(10, max_bytes=1000, target_time=1.0)
+        sizer.update(10, 100, 1.5)
+        self.assertEqual(sizer.page_size, 5)
+        for i in range(5):
+            sizer.update(sizer.page_size, 100, 1.5)
+        self.assertEqual(sizer.page_size, 1)
+
+    def test_max_bytes(self):
+        sizer = fastextras.PageSizer(10, max_bytes=1000, target_time=1.0)
+        self.assert_(sizer.full(3, 1000))
+        # a page closed by size doesn't make the next ones larger
+        sizer.update(3, 1000, 0.1)
+        self.assertEqual(sizer.page_size, 10)
+
+    def test_bounds(self):
+        sizer = fastextras.PageSizer(8, target_time=1.0, max_size=10)
+        sizer.update(8, 100, 0.1)
+        self.assertEqual(sizer.page_size, 10)
+        sizer = fastextras.PageSizer(8, target_time=1.0, min_size=3)
+        sizer.update(8, 100, 1.5)
+        sizer.update(4, 100, 1.5)
+        self.assertEqual(sizer.page_size, 3)
+
+
+class TestValuesPlan(unittest.TestCase):
+    def test_positional(self):
+        plan = fastextras._ValuesPlan([b"insert into t values "], [b" -- a%b"])
+        self.assertEqual(plan.width((1, 2)), 2)
+        self.assertEqual(
+            plan.page_template(2, 2),
+            b"insert into t values (%s,%s),(%s,%s) -- a%%b",
+        )
+        self.assertEqual(plan.values([(1, 2), (3, 4)], 2), [1, 2, 3, 4])
+
+    def test_named(self):
+        plan = fastextras._ValuesPlan(
+            [b"insert into t values "], [], b"(%(id)s, %(val)s, %(id)s, 'a%%b')"
+        )
+        self.assertEqual(plan.names, ["id", "val", "id"])
+        self.assertEqual(plan.width({}), 3)
+        self.assertEqual(
+            plan.page_template(1, 3),
+            b"insert into t values (%s, %s, %s, 'a%%b')",
+        )
+        self.assertEqual(
+            plan.values([dict(id=1, val=10, foo="bar"), dict(id=2, val=20)], 3),
+            [1, 10, 1, 2, 20, 2],
+        )
+
+    def test_bad_records(self):
+        plan = fastextras._ValuesPlan([b"insert into t values "], [])
+        self.assertRaises(TypeError, plan.values, [(1, 10), (2, 20, 99), (3,)], 2)
+        self.assertRaises(TypeError, plan.values, [(1, 10), (3,)], 2)
+        self.assertRaises(TypeError, plan.values, [dict(id=1, val=10)], 2)
+
+    def test_bad_template(self):
+        self.assertRaises(ValueError, fastextras._ValuesPlan, [b""], [], b"(%d)")
+        self.assertRaises(
+            ValueError, fastextras._ValuesPlan, [b""], [], b"(%s, %(id)s)"
+        )
+
+
 class FastExecuteTestMixin(object):
+    # Many tests check the round trips used by the functions
+    counting = True
+
+    # The tests must not commit into testfast: the rows inserted are discarded
+    # at the end, so every test finds the table empty. The id sequence is not
+    # restored by the rollback: insert explicit ids.
     def setUp(self):
         super(FastExecuteTestMixin, self).setUp()
-        cur = self.conn.cursor()
-        cur.execute(
-            """create table testfast (
-            id serial primary key, date date, val int, data text)"""
+        testutils.shared_table(
+            "testfast", "id serial primary key, date date, val int, data text"
         )
+        # Start the transaction here, so that BEGIN is not counted in the tests
+        self.conn.cursor().execute("select 1")
+
+    def tearDown(self):
+        if not self.conn.closed:
+            self.conn.rollback()
+        super(FastExecuteTestMixin, self).tearDown()
 
 
 class TestExecuteBatch(FastExecuteTestMixin, testutils.ConnectingTestCase):
@@ -109,14 +221,17 @@ class TestExecuteBatch(FastExecuteTestMixin, testutils.ConnectingTestCase):
         cur.execute("select id, val from testfast order by id")
         self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(1000)])
 
+    @testutils.max_roundtrips(4)
     def test_pages(self):
         cur = self.conn.cursor()
-        psycopg2.extras.execute_batch(
-            cur,
-            "insert into testfast (id, val) values (%s, %s)",
-            ((i, i * 10) for i in range(25)),
-            page_size=10,
-        )
+        # BEGIN was already sent by setUp: only the pages are counted
+        with self.assertRoundtrips(3):
+            psycopg2.extras.execute_batch(
+                cur,
+                "insert into testfast (id, val) values (%s, %s)",
+                ((i, i * 10) for i in range(25)),
+                page_size=10,
+            )
 
         # last command was 5 statements
         self.assertEqual(sum(c == u";" for c in cur.query.decode("ascii")), 4)
@@ -124,6 +239,18 @@ class TestExecuteBatch(FastExecuteTestMixin, testutils.ConnectingTestCase):
         cur.execute("select id, val from testfast order by id")
         self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(25)])
 
+    def test_max_roundtrips(self):
+        @testutils.max_roundtrips(2)
+        def pages(self):
+            psycopg2.extras.execute_batch(
+                self.conn.cursor(),
+                "insert into testfast (id, val) values (%s, %s)",
+                ((i, i * 10) for i in range(25)),
+                page_size=10,
+            )
+
+        self.assertRaises(self.failureException, pages, self)
+
     @testutils.skip_before_postgres(8, 0)
     def test_unicode(self):
         cur = self.conn.cursor()
@@ -158,6 +285,260 @@ class TestExecuteBatch(FastExecuteTestMixin, testutils.ConnectingTestCase):
         self.assertEqual(cur.fetchone(), (3, snowman))
 
 
+@testutils.skip_before_libpq(14)
+class TestExecuteBatchPipeline(FastExecuteTestMixin, testutils.ConnectingTestCase):
+    def test_empty(self):
+        cur = self.conn.cursor()
+        rv = fastextras.execute_batch_pipeline(
+            cur, "insert into testfast (id, val) values (%s, %s)", []
+        )
+        self.assertEqual(rv.rowcounts, [])
+        self.assertEqual(rv.errors, [])
+
+    def test_many(self):
+        cur = self.conn.cursor()
+        rv = fastextras.execute_batch_pipeline(
+            cur,
+            "insert into testfast (id, val) values (%s, %s)",
+            ((i, i * 10) for i in range(1000)),
+            page_size=10,
+        )
+        self.assertEqual(rv.rowcounts, [1] * 1000)
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(1000)])
+
+    def test_composed(self):
+        cur = self.conn.cursor()
+        fastextras.execute_batch_pipeline(
+            cur,
+            sql.SQL("insert into {0} (id, val) values (%s, %s)").format(
+                sql.Identifier("testfast")
+            ),
+            ((i, i * 10) for i in range(100)),
+        )
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(100)])
+
+    def test_rowcounts(self):
+        cur = self.conn.cursor()
+        psycopg2.extras.execute_values(
+            cur,
+            "insert into testfast (id, val) values %s",
+            ((i, i * 10) for i in range(10)),
+        )
+        rv = fastextras.execute_batch_pipeline(
+            cur,
+            "update testfast set data = 'x' where id < %s",
+            ((i,) for i in range(10)),
+            page_size=3,
+        )
+        self.assertEqual(rv.rowcounts, list(range(10)))
+
+    def test_pages(self):
+        cur = self.conn.cursor()
+        cur.execute("select 1")
+        with self.trace(self.conn) as trace:
+            fastextras.execute_batch_pipeline(
+                cur,
+                "insert into testfast (id, val) values (%s, %s)",
+                ((i, i * 10) for i in range(25)),
+                page_size=10,
+            )
+
+        # a statement per query, a sync point per page
+        self.assertEqual(trace.count("Query", "F"), 0)
+        self.assertEqual(trace.count("Parse", "F"), 25)
+        self.assertEqual(trace.count("Sync", "F"), 3)
+        self.assertEqual(trace.count("ReadyForQuery", "B"), 3)
+
+    def test_transaction(self):
+        # from idle, the first statement starts the transaction
+        self.conn.rollback()
+        cur = self.conn.cursor()
+        fastextras.execute_batch_pipeline(
+            cur,
+            "insert into testfast (id, val) values (%s, %s)",
+            ((i, i * 10) for i in range(25)),
+            page_size=10,
+        )
+        self.assertEqual(
+            self.conn.info.transaction_status, ext.TRANSACTION_STATUS_INTRANS
+        )
+        self.conn.rollback()
+        cur.execute("select count(*) from testfast")
+        self.assertEqual(cur.fetchone()[0], 0)
+
+    def autocommit_cursor(self):
+        """Return an autocommit cursor and empty the testfastcommit table.
+
+        The tests in autocommit commit their data: they use their own table,
+        so that what they leave behind can't affect the testfast tests.
+        """
+        testutils.shared_table("testfastcommit", "id int primary key, val int")
+        self.conn.rollback()
+        self.conn.autocommit = True
+        cur = self.conn.cursor()
+        cur.execute("truncate testfastcommit")
+        return cur
+
+    def test_autocommit(self):
+        cur = self.autocommit_cursor()
+        fastextras.execute_batch_pipeline(
+            cur,
+            "insert into testfastcommit (id, val) values (%s, %s)",
+            ((i, i * 10) for i in range(25)),
+            page_size=10,
+        )
+        self.assertEqual(self.conn.info.transaction_status, ext.TRANSACTION_STATUS_IDLE)
+        cur.execute("select count(*) from testfastcommit")
+        self.assertEqual(cur.fetchone()[0], 25)
+
+    def test_error(self):
+        cur = self.conn.cursor()
+        self.assertRaises(
+            psycopg2.IntegrityError,
+            fastextras.execute_batch_pipeline,
+            cur,
+            "insert into testfast (id, val) values (%s, %s)",
+            [(i % 7, i) for i in range(25)],
+            page_size=5,
+        )
+        self.conn.rollback()
+        cur.execute("select 1")
+        self.assertEqual(cur.fetchone(), (1,))
+
+    def test_errors(self):
+        cur = self.autocommit_cursor()
+        rv = fastextras.execute_batch_pipeline(
+            cur,
+            "insert into testfastcommit (id, val) values (%s, %s)",
+            [(i % 7, i) for i in range(10)],
+            page_size=5,
+            raise_errors=False,
+        )
+        # the 8th statement fails, the rest of its page is aborted
+        self.assertEqual(rv.rowcounts, [1] * 5 + [1, 1, None, None, None])
+        self.assertEqual(len(rv.errors), 1)
+        self.assertEqual(rv.errors[0][0], 7)
+        self.assert_(isinstance(rv.errors[0][1], psycopg2.IntegrityError))
+
+        # each page is a transaction on its own
+        cur.execute("select id from testfastcommit order by id")
+        self.assertEqual(cur.fetchall(), [(i,) for i in range(5)])
+
+
+class TestExecuteBatchPrepared(FastExecuteTestMixin, testutils.ConnectingTestCase):
+    def prepared(self):
+        cur = self.conn.cursor()
+        cur.execute(
+            "select statement from pg_prepared_statements"
+            " where name like '_psycopg2_batch_%' order by prepare_time"
+        )
+        return [r[0] for r in cur.fetchall()]
+
+    def test_empty(self):
+        cur = self.conn.cursor()
+        fastextras.execute_batch_prepared(
+            cur, "insert into testfast (id, val) values (%s, %s)", []
+        )
+        cur.execute("select * from testfast order by id")
+        self.assertEqual(cur.fetchall(), [])
+
+    def test_many(self):
+        cur = self.conn.cursor()
+        fastextras.execute_batch_prepared(
+            cur,
+            "insert into testfast (id, val) values (%s, %s)",
+            ((i, i * 10) for i in range(1000)),
+        )
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(1000)])
+
+    def test_dicts(self):
+        cur = self.conn.cursor()
+        fastextras.execute_batch_prepared(
+            cur,
+            "insert into testfast (id, date, val) values (%(id)s, %(date)s, %(val)s)",
+            (dict(id=i, date=date(2017, 1, i + 1), val=i * 10) for i in range(10)),
+        )
+        cur.execute("select id, date, val from testfast order by id")
+        self.assertEqual(
+            cur.fetchall(),
+            [(i, date(2017, 1, i + 1), i * 10) for i in range(10)],
+        )
+
+    def test_composed(self):
+        cur = self.conn.cursor()
+        query = sql.SQL("insert into {0} (id, val) values (%s, %s)").format(
+            sql.Identifier("testfast")
+        )
+        for i in range(2):
+            fastextras.execute_batch_prepared(
+                cur, query, ((i * 100 + j, j) for j in range(100))
+            )
+
+        cur.execute("select count(*) from testfast")
+        self.assertEqual(cur.fetchone()[0], 200)
+        self.assertEqual(len(self.prepared()), 1)
+
+    def test_pages(self):
+        cur = self.conn.cursor()
+        # PREPARE, then a statement per page
+        with self.assertRoundtrips(4):
+            fastextras.execute_batch_prepared(
+                cur,
+                "insert into testfast (id, val) values (%s, %s)",
+                ((i, i * 10) for i in range(25)),
+                page_size=10,
+            )
+        self.assertEqual(sum(c == ";" for c in cur.query.decode("ascii")), 4)
+        self.assert_(cur.query.startswith(b"EXECUTE "))
+
+        with self.assertRoundtrips(3):
+            fastextras.execute_batch_prepared(
+                cur,
+                "insert into testfast (id, val) values (%s, %s)",
+                ((i, i * 10) for i in range(25, 50)),
+                page_size=10,
+            )
+
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(50)])
+
+    def test_lru(self):
+        cur = self.conn.cursor()
+        queries = [
+            "insert into testfast (id, val) values (%s, %s)",
+            "insert into testfast (id, data) values (%s, %s)",
+            "insert into testfast (val, id) values (%s, %s)",
+        ]
+        size = fastextras.prepared_cache_size
+        fastextras.prepared_cache_size = 2
+        try:
+            for i, query in enumerate(queries):
+                fastextras.execute_batch_prepared(cur, query, [(i, str(i))])
+            fastextras.execute_batch_prepared(cur, queries[1], [(10, "x")])
+            fastextras.execute_batch_prepared(cur, queries[0], [(11, 11)])
+        finally:
+            fastextras.prepared_cache_size = size
+
+        # the second statement was used more recently than the third
+        prepared = self.prepared()
+        self.assertEqual(len(prepared), 2)
+        self.assert_("(id, data)" in prepared[0])
+        self.assert_("(id, val)" in prepared[1])
+
+    def test_rollback(self):
+        # prepared statements are not transactional
+        cur = self.conn.cursor()
+        query = "insert into testfast (id, val) values (%s, %s)"
+        fastextras.execute_batch_prepared(cur, query, [(1, 10)])
+        self.conn.rollback()
+        fastextras.execute_batch_prepared(cur, query, [(2, 20)])
+        cur.execute("select id, val from testfast")
+        self.assertEqual(cur.fetchall(), [(2, 20)])
+
+
 @testutils.skip_before_postgres(8, 2)
 class TestExecuteValues(FastExecuteTestMixin, testutils.ConnectingTestCase):
     def test_empty(self):
@@ -230,12 +611,13 @@ class TestExecuteValues(FastExecuteTestMixin, testutils.ConnectingTestCase):
 
     def test_pages(self):
         cur = self.conn.cursor()
-        psycopg2.extras.execute_values(
-            cur,
-            "insert into testfast (id, val) values %s",
-            ((i, i * 10) for i in range(25)),
-            page_size=10,
-        )
+        with self.assertRoundtrips(3):
+            psycopg2.extras.execute_values(
+                cur,
+                "insert into testfast (id, val) values %s",
+                ((i, i * 10) for i in range(25)),
+                page_size=10,
+            )
 
         # last statement was 5 tuples (one parens is for the fields list)
         self.assertEqual(sum(c == "(" for c in cur.query.decode("ascii")), 6)
@@ -243,6 +625,33 @@ class TestExecuteValues(FastExecuteTestMixin, testutils.ConnectingTestCase):
         cur.execute("select id, val from testfast order by id")
         self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(25)])
 
+    def test_pages_messages(self):
+        cur = self.conn.cursor()
+        with self.trace(self.conn) as trace:
+            psycopg2.extras.execute_values(
+                cur,
+                "insert into testfast (id, val) values %s",
+                ((i, i * 10) for i in range(25)),
+                page_size=10,
+            )
+
+        # a simple query per page, no extended protocol
+        self.assertEqual(trace.count("Query", "F"), 3)
+        self.assertEqual(trace.count("Parse", "F"), 0)
+        self.assertEqual(trace.count("CommandComplete", "B"), 3)
+        self.assert_(all(m[0] is not None for m in trace.messages[1:]))
+
+    def test_pages_messages_flags(self):
+        cur = self.conn.cursor()
+        flags = testutils.PQTRACE_SUPPRESS_TIMESTAMPS
+        with self.trace(self.conn, flags=flags) as trace:
+            psycopg2.extras.execute_values(
+                cur, "insert into testfast (id, val) values %s", [(1, 10)]
+            )
+
+        self.assertEqual(trace.count("Query", "F"), 1)
+        self.assert_(all(m[0] is None for m in trace.messages))
+
     def test_unicode(self):
         cur = self.conn.cursor()
         ext.register_type(ext.UNICODE, cur)
@@ -316,6 +725,817 @@ class TestExecuteValues(FastExecuteTestMixin, testutils.ConnectingTestCase):
         self.assertEqual(cur.fetchall(), [(1, "hi")])
 
 
+class TestExecuteBatchStream(FastExecuteTestMixin, testutils.ConnectingTestCase):
+    def test_empty(self):
+        cur = self.conn.cursor()
+        with self.assertRoundtrips(0):
+            fastextras.execute_batch_stream(
+                cur, "insert into testfast (id, val) values (%s, %s)", []
+            )
+
+    def test_many(self):
+        cur = self.conn.cursor()
+        fastextras.execute_batch_stream(
+            cur,
+            "insert into testfast (id, val) values (%s, %s)",
+            ((i, i * 10) for i in range(1000)),
+        )
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(1000)])
+
+    def test_pages(self):
+        cur = self.conn.cursor()
+        with self.assertRoundtrips(3):
+            fastextras.execute_batch_stream(
+                cur,
+                "insert into testfast (id, val) values (%s, %s)",
+                ((i, i * 10) for i in range(25)),
+                page_size=10,
+            )
+
+        # last command was 5 statements
+        self.assertEqual(sum(c == ";" for c in cur.query.decode("ascii")), 4)
+
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(25)])
+
+    def test_composed(self):
+        cur = self.conn.cursor()
+        fastextras.execute_batch_stream(
+            cur,
+            sql.SQL("insert into {0} (id, val) values (%s, %s)").format(
+                sql.Identifier("testfast")
+            ),
+            ((i, i * 10) for i in range(100)),
+        )
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(100)])
+
+
+@testutils.skip_before_postgres(8, 2)
+class TestExecuteValuesStream(FastExecuteTestMixin, testutils.ConnectingTestCase):
+    def test_empty(self):
+        cur = self.conn.cursor()
+        with self.assertRoundtrips(0):
+            fastextras.execute_values_stream(
+                cur, "insert into testfast (id, val) values %s", []
+            )
+
+    def test_pages(self):
+        cur = self.conn.cursor()
+        with self.assertRoundtrips(3):
+            fastextras.execute_values_stream(
+                cur,
+                "insert into testfast (id, val) values %s",
+                ((i, i * 10) for i in range(25)),
+                page_size=10,
+            )
+
+        # last statement was 5 tuples (one parens is for the fields list)
+        self.assertEqual(sum(c == "(" for c in cur.query.decode("ascii")), 6)
+
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(25)])
+
+    def test_dicts(self):
+        cur = self.conn.cursor()
+        fastextras.execute_values_stream(
+            cur,
+            "insert into testfast (id, date, val) values %s",
+            (
+                dict(id=i, date=date(2017, 1, i + 1), val=i * 10, foo="bar")
+                for i in range(10)
+            ),
+            template="(%(id)s, %(date)s, %(val)s)",
+        )
+        cur.execute("select id, date, val from testfast order by id")
+        self.assertEqual(
+            cur.fetchall(),
+            [(i, date(2017, 1, i + 1), i * 10) for i in range(10)],
+        )
+
+    def test_unicode(self):
+        cur = self.conn.cursor()
+        ext.register_type(ext.UNICODE, cur)
+        snowman = u"\u2603"
+        fastextras.execute_values_stream(
+            cur,
+            "insert into testfast (id, data) values %%s -- %s" % snowman,
+            [(1, snowman)],
+        )
+        cur.execute("select id, data from testfast where id = 1")
+        self.assertEqual(cur.fetchone(), (1, snowman))
+
+    def test_returning(self):
+        cur = self.conn.cursor()
+        result = fastextras.execute_values_stream(
+            cur,
+            "insert into testfast (id, val) values %s returning id",
+            ((i, i * 10) for i in range(25)),
+            page_size=10,
+            fetch=True,
+        )
+        # result contains all returned pages
+        self.assertEqual([r[0] for r in result], list(range(25)))
+
+    def test_iter(self):
+        cur = self.conn.cursor()
+        with self.assertRoundtrips(0):
+            rows = fastextras.execute_values_iter(
+                cur,
+                "insert into testfast (id, val) values %s returning id",
+                ((i, i * 10) for i in range(25)),
+                page_size=10,
+            )
+
+        # the first page
+        with self.assertRoundtrips(1):
+            self.assertEqual(next(rows), (0,))
+
+        # the rest of the first page is already here
+        with self.assertRoundtrips(0):
+            for i in range(1, 10):
+                self.assertEqual(next(rows), (i,))
+
+        self.assertEqual([r[0] for r in rows], list(range(10, 25)))
+
+    def test_iter_empty(self):
+        cur = self.conn.cursor()
+        rows = fastextras.execute_values_iter(
+            cur, "insert into testfast (id, val) values %s returning id", []
+        )
+        self.assertEqual(list(rows), [])
+
+
+@testutils.skip_copy_if_green
+class TestCopyValues(FastExecuteTestMixin, testutils.ConnectingTestCase):
+    def test_empty(self):
+        cur = self.conn.cursor()
+        fastextras.copy_values(cur, "testfast", ["id", "val"], [])
+        cur.execute("select * from testfast order by id")
+        self.assertEqual(cur.fetchall(), [])
+
+    def test_tuples(self):
+        cur = self.conn.cursor()
+        fastextras.copy_values(
+            cur,
+            "testfast",
+            ["id", "date", "val"],
+            ((i, date(2017, 1, i + 1), i * 10) for i in range(10)),
+        )
+        cur.execute("select id, date, val from testfast order by id")
+        self.assertEqual(
+            cur.fetchall(),
+            [(i, date(2017, 1, i + 1), i * 10) for i in range(10)],
+        )
+
+    def test_dicts(self):
+        cur = self.conn.cursor()
+        fastextras.copy_values(
+            cur,
+            "testfast",
+            ["id", "date", "val"],
+            (
+                dict(id=i, date=date(2017, 1, i + 1), val=i * 10, foo="bar")
+                for i in range(10)
+            ),
+        )
+        cur.execute("select id, date, val from testfast order by id")
+        self.assertEqual(
+            cur.fetchall(),
+            [(i, date(2017, 1, i + 1), i * 10) for i in range(10)],
+        )
+
+    def test_many(self):
+        cur = self.conn.cursor()
+        fastextras.copy_values(
+            cur,
+            sql.Identifier("testfast"),
+            ["id", "val"],
+            ((i, i * 10) for i in range(10000)),
+            size=1000,
+        )
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(10000)])
+
+    def test_nulls_unicode(self):
+        cur = self.conn.cursor()
+        ext.register_type(ext.UNICODE, cur)
+        snowman = u"\u2603"
+        fastextras.copy_values(
+            cur,
+            "testfast",
+            ["id", "date", "val", "data"],
+            [(1, None, None, snowman), (2, None, 20, None)],
+        )
+        cur.execute("select id, date, val, data from testfast order by id")
+        self.assertEqual(
+            cur.fetchall(), [(1, None, None, snowman), (2, None, 20, None)]
+        )
+
+    def test_text_fallback(self):
+        cur = self.conn.cursor()
+        cur.execute(
+            "create temp table testcopy (id int, num numeric, ts timestamptz,"
+            " data bytea, t text)"
+        )
+        ts = datetime(2020, 1, 2, 3, 4, 5, tzinfo=FixedOffsetTimezone(offset=0))
+        rows = [
+            (1, Decimal("1.5"), ts, b"\x00\\\xff", "a\tb\\c\nd"),
+            (2, None, None, None, None),
+        ]
+        fastextras.copy_values(cur, "testcopy", ["id", "num", "ts", "data", "t"], rows)
+        cur.execute("select id, num, ts, data, t from testcopy order by id")
+        got = cur.fetchall()
+        self.assertEqual(got[0][:3], rows[0][:3])
+        self.assertEqual(bytes(got[0][3]), rows[0][3])
+        self.assertEqual(got[0][4], rows[0][4])
+        self.assertEqual(got[1], rows[1])
+
+    def test_arrays(self):
+        cur = self.conn.cursor()
+        cur.execute("create temp table testcopy (id int, nums int[], strs text[])")
+        rows = [
+            (1, [1, None, 3], ["a", 'b"c', "d\\e", None, "", "NULL", "f\tg"]),
+            (2, [[1, 2], [3, 4]], []),
+        ]
+        fastextras.copy_values(cur, "testcopy", ["id", "nums", "strs"], rows)
+        cur.execute("select id, nums, strs from testcopy order by id")
+        self.assertEqual(cur.fetchall(), rows)
+
+    def test_datetime_to_date(self):
+        cur = self.conn.cursor()
+        fastextras.copy_values(
+            cur, "testfast", ["id", "date"], [(1, datetime(2017, 1, 2, 10, 20))]
+        )
+        cur.execute("select id, date from testfast")
+        self.assertEqual(cur.fetchall(), [(1, date(2017, 1, 2))])
+
+    def test_aware_datetime(self):
+        cur = self.conn.cursor()
+        cur.execute("create temp table testcopy (id int, ts timestamp)")
+        ts = datetime(2020, 1, 2, 3, 4, 5, tzinfo=FixedOffsetTimezone(offset=60))
+        for table, column in [("testcopy", "ts"), ("testfast", "date")]:
+            self.assertRaises(
+                ValueError,
+                fastextras.copy_values,
+                cur,
+                table,
+                ["id", column],
+                [(1, ts)],
+            )
+            self.conn.rollback()
+
+    def test_bad_records(self):
+        cur = self.conn.cursor()
+        for rows in [[(1, 10), (2, 20, 99)], [(1, 10), (2,)]]:
+            self.assertRaises(
+                ValueError, fastextras.copy_values, cur, "testfast", ["id", "val"], rows
+            )
+            self.conn.rollback()
+
+        # in text format too
+        cur.execute("create temp table testcopy (id int, num numeric)")
+        self.assertRaises(
+            ValueError,
+            fastextras.copy_values,
+            cur,
+            "testcopy",
+            ["id", "num"],
+            [(1, Decimal("1.5"), None)],
+        )
+
+    def test_input_error(self):
+        def rows():
+            yield (1, 10)
+            raise ZeroDivisionError
+
+        cur = self.conn.cursor()
+        self.assertRaises(
+            ZeroDivisionError,
+            fastextras.copy_values,
+            cur,
+            "testfast",
+            ["id", "val"],
+            rows(),
+        )
+
+    def test_adapters(self):
+        cur = self.conn.cursor()
+        cur.execute("create temp table testcopy (id int, j json, t text)")
+        fastextras.copy_values(
+            cur,
+            "testcopy",
+            ["id", "j", "t"],
+            [(1, psycopg2.extras.Json({"a": [1, 2]}), psycopg2.extras.Json("x"))],
+        )
+        cur.execute("select id, j, t from testcopy")
+        self.assertEqual(cur.fetchall(), [(1, {"a": [1, 2]}, '"x"')])
+
+        for obj in [ext.AsIs("1"), ext.QuotedString("a")]:
+            self.assertRaises(
+                TypeError,
+                fastextras.copy_values,
+                cur,
+                "testfast",
+                ["id", "data"],
+                [(1, obj)],
+            )
+            self.conn.rollback()
+
+    def test_bad_column(self):
+        cur = self.conn.cursor()
+        self.assertRaises(
+            psycopg2.ProgrammingError,
+            fastextras.copy_values,
+            cur,
+            "testfast",
+            ["id", "nosuch"],
+            [(1, 2)],
+        )
+
+
+class TestParallelLoad(testutils.ConnectingTestCase):
+    # The data is committed: the table is emptied at the end of every test
+    def setUp(self):
+        super(TestParallelLoad, self).setUp()
+        testutils.shared_table("testparallel", "id int primary key, val int")
+
+    def tearDown(self):
+        if not self.conn.closed:
+            self.conn.rollback()
+            cur = self.conn.cursor()
+            cur.execute("delete from testparallel")
+            self.conn.commit()
+        super(TestParallelLoad, self).tearDown()
+
+    def load_values(self, cur, rows):
+        psycopg2.extras.execute_values(
+            cur, "insert into testparallel (id, val) values %s", rows
+        )
+
+    def load_copy(self, cur, rows):
+        fastextras.copy_values(cur, "testparallel", ["id", "val"], rows)
+
+    def loaded(self):
+        cur = self.conn.cursor()
+        cur.execute("select id, val from testparallel order by id")
+        rv = cur.fetchall()
+        self.conn.rollback()
+        return rv
+
+    def test_values(self):
+        conns = [self.connect() for i in range(3)]
+        counts = fastextras.parallel_load(
+            conns,
+            self.load_values,
+            ((i, i * 10) for i in range(1000)),
+            key=lambda r: r[0] % 3,
+            batch_size=10,
+        )
+        self.assertEqual(counts, [334, 333, 333])
+        self.assertEqual(self.loaded(), [(i, i * 10) for i in range(1000)])
+
+    @testutils.skip_copy_if_green
+    def test_copy(self):
+        conns = [self.connect() for i in range(3)]
+        counts = fastextras.parallel_load(
+            conns,
+            self.load_copy,
+            ((i, i * 10) for i in range(1000)),
+            batch_size=100,
+        )
+        self.assertEqual(sum(counts), 1000)
+        self.assertEqual(self.loaded(), [(i, i * 10) for i in range(1000)])
+
+    def test_dsn(self):
+        counts = fastextras.parallel_load(
+            testutils.dsn,
+            self.load_values,
+            ((i, i * 10) for i in range(100)),
+            workers=2,
+            batch_size=10,
+        )
+        self.assertEqual(counts, [50, 50])
+        self.assertEqual(self.loaded(), [(i, i * 10) for i in range(100)])
+
+    def test_error(self):
+        conns = [self.connect() for i in range(3)]
+        # the duplicate key fails the load of a connection
+        rows = [(i % 500, i) for i in range(1000)]
+        self.assertRaises(
+            psycopg2.IntegrityError,
+            fastextras.parallel_load,
+            conns,
+            self.load_values,
+            rows,
+            key=lambda r: r[0] % 3,
+            batch_size=10,
+        )
+        self.assertEqual(self.loaded(), [])
+        for conn in conns:
+            self.assertEqual(conn.info.transaction_status, ext.TRANSACTION_STATUS_IDLE)
+
+    def test_input_error(self):
+        def rows():
+            for i in range(100):
+                yield (i, i)
+            raise ZeroDivisionError
+
+        conns = [self.connect() for i in range(3)]
+        self.assertRaises(
+            ZeroDivisionError,
+            fastextras.parallel_load,
+            conns,
+            self.load_values,
+            rows(),
+            batch_size=10,
+        )
+        self.assertEqual(self.loaded(), [])
+
+    @testutils.skip_if_tpc_disabled
+    def test_tpc(self):
+        conns = [self.connect() for i in range(3)]
+        fastextras.parallel_load(
+            conns,
+            self.load_values,
+            ((i, i * 10) for i in range(1000)),
+            key=lambda r: r[0] % 3,
+            tpc=True,
+        )
+        self.assertEqual(self.loaded(), [(i, i * 10) for i in range(1000)])
+
+    @testutils.skip_if_tpc_disabled
+    def test_tpc_error(self):
+        conns = [self.connect() for i in range(3)]
+        # the partition failing is the last to receive data: the others
+        # prepare their transaction before it fails
+        rows = [(i, i) for i in range(1000)] + [(0, 0)]
+        self.assertRaises(
+            psycopg2.IntegrityError,
+            fastextras.parallel_load,
+            conns,
+            self.load_values,
+            rows,
+            key=lambda r: r[0] % 3,
+            tpc=True,
+        )
+        self.assertEqual(self.loaded(), [])
+
+        cur = self.conn.cursor()
+        cur.execute(
+            "select count(*) from pg_prepared_xacts"
+            " where database = current_database()"
+        )
+        self.assertEqual(cur.fetchone()[0], 0)
+
+    @testutils.skip_copy_if_green
+    @testutils.skip_if_tpc_disabled
+    def test_copy_error(self):
+        conns = [self.connect() for i in range(3)]
+        # the duplicate key fails a COPY while the others are still loading:
+        # they are aborted, but the error raised must be the original one
+        rows = [(0, 0)] + [(i, i) for i in range(100000)]
+        self.assertRaises(
+            psycopg2.IntegrityError,
+            fastextras.parallel_load,
+            conns,
+            self.load_copy,
+            rows,
+            key=lambda r: r[0] % 3,
+            tpc=True,
+        )
+        self.assertEqual(self.loaded(), [])
+
+        cur = self.conn.cursor()
+        cur.execute(
+            "select count(*) from pg_prepared_xacts"
+            " where database = current_database()"
+        )
+        self.assertEqual(cur.fetchone()[0], 0)
+        for conn in conns:
+            self.assertEqual(conn.info.transaction_status, ext.TRANSACTION_STATUS_IDLE)
+
+
+@testutils.skip_before_postgres(8, 2)
+class TestExecuteValuesAdaptive(FastExecuteTestMixin, testutils.ConnectingTestCase):
+    def test_empty(self):
+        cur = self.conn.cursor()
+        with self.assertRoundtrips(0):
+            fastextras.execute_values_adaptive(
+                cur, "insert into testfast (id, val) values %s", []
+            )
+
+    def test_many(self):
+        cur = self.conn.cursor()
+        sizer = fastextras.PageSizer(10, target_time=60.0)
+        fastextras.execute_values_adaptive(
+            cur,
+            "insert into testfast (id, val) values %s",
+            ((i, i * 10) for i in range(1000)),
+            sizer=sizer,
+        )
+        # fast pages make the following ones larger
+        self.assertEqual(sizer.sizes[:4], [10, 20, 40, 80])
+        self.assertEqual(sum(sizer.sizes), 1000)
+
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(1000)])
+
+    def test_max_bytes(self):
+        cur = self.conn.cursor()
+        sizer = fastextras.PageSizer(100, max_bytes=200, target_time=60.0)
+        fastextras.execute_values_adaptive(
+            cur,
+            "insert into testfast (id, data) values %s",
+            ((i, "x" * 50) for i in range(10)),
+            sizer=sizer,
+        )
+        self.assert_(len(sizer.sizes) > 1)
+        self.assert_(max(sizer.sizes) < 10)
+        self.assertEqual(sum(sizer.sizes), 10)
+
+        cur.execute("select count(*) from testfast")
+        self.assertEqual(cur.fetchone()[0], 10)
+
+    def test_composed(self):
+        cur = self.conn.cursor()
+        fastextras.execute_values_adaptive(
+            cur,
+            sql.SQL("insert into {0} (id, val) values %s").format(
+                sql.Identifier("testfast")
+            ),
+            ((i, i * 10) for i in range(100)),
+        )
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(100)])
+
+    def test_returning(self):
+        cur = self.conn.cursor()
+        result = fastextras.execute_values_adaptive(
+            cur,
+            "insert into testfast (id, val) values %s returning id",
+            ((i, i * 10) for i in range(25)),
+            page_size=3,
+            max_bytes=50,
+            fetch=True,
+        )
+        # result contains all returned pages
+        self.assertEqual([r[0] for r in result], list(range(25)))
+
+
+class TestExecuteValuesCompiled(FastExecuteTestMixin, testutils.ConnectingTestCase):
+    def setUp(self):
+        super(TestExecuteValuesCompiled, self).setUp()
+        fastextras._values_plans.clear()
+
+    def test_empty(self):
+        cur = self.conn.cursor()
+        with self.assertRoundtrips(0):
+            fastextras.execute_values_compiled(
+                cur, "insert into testfast (id, val) values %s", []
+            )
+
+    def test_tuples(self):
+        cur = self.conn.cursor()
+        fastextras.execute_values_compiled(
+            cur,
+            "insert into testfast (id, date, val) values %s",
+            ((i, date(2017, 1, i + 1), i * 10) for i in range(10)),
+        )
+        cur.execute("select id, date, val from testfast order by id")
+        self.assertEqual(
+            cur.fetchall(), [(i, date(2017, 1, i + 1), i * 10) for i in range(10)]
+        )
+
+    def test_dicts(self):
+        cur = self.conn.cursor()
+        fastextras.execute_values_compiled(
+            cur,
+            "insert into testfast (id, date, val) values %s",
+            (
+                dict(id=i, date=date(2017, 1, i + 1), val=i * 10, foo="bar")
+                for i in range(10)
+            ),
+            template="(%(id)s, %(date)s, %(val)s)",
+        )
+        cur.execute("select id, date, val from testfast order by id")
+        self.assertEqual(
+            cur.fetchall(), [(i, date(2017, 1, i + 1), i * 10) for i in range(10)]
+        )
+
+    def test_template_literals(self):
+        cur = self.conn.cursor()
+        fastextras.execute_values_compiled(
+            cur,
+            "insert into testfast (id, data, val) values %s",
+            [(1, 10), (2, 20)],
+            template="(%s, 'a%%b', %s)",
+        )
+        cur.execute("select id, data, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(1, "a%b", 10), (2, "a%b", 20)])
+
+    def test_composed(self):
+        cur = self.conn.cursor()
+        fastextras.execute_values_compiled(
+            cur,
+            sql.SQL("insert into {0} (id, val) values %s").format(
+                sql.Identifier("testfast")
+            ),
+            ((i, i * 10) for i in range(25)),
+            page_size=10,
+        )
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(25)])
+
+    def test_pages(self):
+        cur = self.conn.cursor()
+        with self.assertRoundtrips(3):
+            fastextras.execute_values_compiled(
+                cur,
+                "insert into testfast (id, val) values %s",
+                ((i, i * 10) for i in range(25)),
+                page_size=10,
+            )
+
+        # last statement was 5 tuples (one parens is for the fields list)
+        self.assertEqual(sum(c == "(" for c in cur.query.decode("ascii")), 6)
+
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(i, i * 10) for i in range(25)])
+
+    def test_returning(self):
+        cur = self.conn.cursor()
+        result = fastextras.execute_values_compiled(
+            cur,
+            "insert into testfast (id, val) values %s returning id",
+            ((i, i * 10) for i in range(25)),
+            page_size=10,
+            fetch=True,
+        )
+        # result contains all returned pages
+        self.assertEqual([r[0] for r in result], list(range(25)))
+
+    def test_invalid_sql(self):
+        cur = self.conn.cursor()
+        f = fastextras.execute_values_compiled
+        self.assertRaises(ValueError, f, cur, "insert", [])
+        self.assertRaises(ValueError, f, cur, "insert %s and %s", [])
+        self.assertRaises(ValueError, f, cur, "insert %f", [])
+        self.assertRaises(ValueError, f, cur, "insert %f %s", [])
+        self.assertRaises(
+            ValueError, f, cur, "insert %s", [(1,)], template="(%s, %(id)s)"
+        )
+
+    def test_bad_records(self):
+        cur = self.conn.cursor()
+        self.assertRaises(
+            TypeError,
+            fastextras.execute_values_compiled,
+            cur,
+            "insert into testfast (id, val) values %s",
+            [(1, 10), (2, 20, 99), (3,)],
+        )
+        self.conn.rollback()
+
+        # a wrong record in a later page is detected too
+        self.assertRaises(
+            TypeError,
+            fastextras.execute_values_compiled,
+            cur,
+            "insert into testfast (id, val) values %s",
+            [(1, 10), (2, 20), (3,)],
+            page_size=2,
+        )
+        self.conn.rollback()
+
+        # mappings need a template with names
+        self.assertRaises(
+            TypeError,
+            fastextras.execute_values_compiled,
+            cur,
+            "insert into testfast (id, val) values %s",
+            [dict(id=1, val=10), dict(id=2, val=20)],
+        )
+        self.conn.rollback()
+
+        cur.execute("select count(*) from testfast")
+        self.assertEqual(cur.fetchone()[0], 0)
+
+    def test_percent_escape(self):
+        cur = self.conn.cursor()
+        fastextras.execute_values_compiled(
+            cur,
+            "insert into testfast (id, data) values %s -- a%%b",
+            [(1, "hi")],
+        )
+        self.assert_(b"a%%b" not in cur.query)
+        self.assert_(b"a%b" in cur.query)
+
+        cur.execute("select id, data from testfast")
+        self.assertEqual(cur.fetchall(), [(1, "hi")])
+
+    def test_cache(self):
+        cur = self.conn.cursor()
+        query = "insert into testfast (id, val) values %s"
+        fastextras.execute_values_compiled(cur, query, [(1, 10)])
+        self.assertEqual(len(fastextras._values_plans), 1)
+        plan = list(fastextras._values_plans.values())[0]
+
+        fastextras.execute_values_compiled(cur, query, [(2, 20)])
+        self.assertEqual(list(fastextras._values_plans.values()), [plan])
+
+        cur.execute("select id, val from testfast order by id")
+        self.assertEqual(cur.fetchall(), [(1, 10), (2, 20)])
+
+    def test_cache_size(self):
+        cur = self.conn.cursor()
+        orig = fastextras.values_plan_cache_size
+        fastextras.values_plan_cache_size = 2
+        try:
+            for i in range(5):
+                fastextras.execute_values_compiled(
+                    cur,
+                    "insert into testfast (id, val) values %%s -- %d" % i,
+                    [(i, i * 10)],
+                )
+        finally:
+            fastextras.values_plan_cache_size = orig
+
+        self.assertEqual(
+            [k[0] for k in fastextras._values_plans],
+            [
+                b"insert into testfast (id, val) values %s -- 3",
+                b"insert into testfast (id, val) values %s -- 4",
+            ],
+        )
+        cur.execute("select count(*) from testfast")
+        self.assertEqual(cur.fetchone()[0], 5)
+
+
+class TestMogrifyMany(testutils.ConnectingTestCase):
+    def test_empty(self):
+        cur = self.conn.cursor()
+        self.assertEqual(fastextras.mogrify_many(cur, "(%s, %s)", []), b"")
+
+    def test_tuples(self):
+        cur = self.conn.cursor()
+        argslist = [(i, date(2017, 1, i + 1), "x%s" % i) for i in range(10)]
+        self.assertEqual(
+            fastextras.mogrify_many(cur, "(%s, %s, %s)", argslist),
+            b",".join(cur.mogrify("(%s, %s, %s)", args) for args in argslist),
+        )
+
+    def test_dicts(self):
+        cur = self.conn.cursor()
+        argslist = [dict(id=i, val=i * 10, foo="bar") for i in range(10)]
+        template = "(%(id)s, %(val)s, %(id)s)"
+        self.assertEqual(
+            fastextras.mogrify_many(cur, template, argslist),
+            b",".join(cur.mogrify(template, args) for args in argslist),
+        )
+
+    def test_sep(self):
+        cur = self.conn.cursor()
+        self.assertEqual(
+            fastextras.mogrify_many(
+                cur, "select %s, 'a%%b'", [(1,), ("x",)], sep=b";\n"
+            ),
+            b"select 1, 'a%b';\nselect 'x', 'a%b'",
+        )
+        self.assertEqual(
+            fastextras.mogrify_many(cur, "(%s)", [(1,), (2,)], sep=" % "),
+            b"(1) % (2)",
+        )
+
+    def test_unicode(self):
+        cur = self.conn.cursor()
+        snowman = u"\u2603"
+        self.assertEqual(
+            fastextras.mogrify_many(cur, "(%s)", [(snowman,)]).decode("utf8"),
+            u"('%s')" % snowman,
+        )
+
+    def test_bad_template(self):
+        cur = self.conn.cursor()
+        self.assertRaises(
+            ValueError, fastextras.mogrify_many, cur, "(%s, %(id)s)", [(1,)]
+        )
+        self.assertRaises(ValueError, fastextras.mogrify_many, cur, "(%d)", [(1,)])
+
+    def test_bad_records(self):
+        cur = self.conn.cursor()
+        self.assertRaises(
+            TypeError, fastextras.mogrify_many, cur, "(%s, %s)", [(1, 2, 3), (4,)]
+        )
+        self.assertRaises(
+            TypeError, fastextras.mogrify_many, cur, "(%s, %s)", [(1, 2), (3,)]
+        )
+        self.assertRaises(
+            TypeError, fastextras.mogrify_many, cur, "(%s, %s)", [dict(a=1, b=2)]
+        )
+
+
 def test_suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
 
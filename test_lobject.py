@@ -35,6 +35,7 @@ from .testutils import (
     decorate_all_tests,
     skip_if_tpc_disabled,
     skip_before_postgres,
+    server_caps,
     ConnectingTestCase,
     skip_if_green,
     slow,
@@ -456,10 +457,11 @@ class LargeObjectTruncateTests(LargeObjectTestCase):
 
 def _has_lo64(conn):
     """Return (bool, msg) about the lo64 support"""
-    if conn.info.server_version < 90300:
+    caps = server_caps(conn)
+    if caps.server_version < 90300:
         return (
             False,
-            "server version %s doesn't support the lo64 API" % conn.info.server_version,
+            "server version %s doesn't support the lo64 API" % caps.server_version,
         )
 
     if "lo64" not in psycopg2.__version__:
@@ -52,16 +52,51 @@ class ReplicationTestCase(ConnectingTestCase):
         # first close all connections, as they might keep the slot(s) active
         super(ReplicationTestCase, self).tearDown()
 
-        time.sleep(0.025)  # sometimes the slot is still active, wait a little
-
         if self._slots:
             kill_conn = self.connect()
             if kill_conn:
-                kill_cur = kill_conn.cursor()
-                for slot in self._slots:
-                    kill_cur.execute("SELECT pg_drop_replication_slot(%s)", (slot,))
-                kill_conn.commit()
-                kill_conn.close()
+                self.drop_replication_slots(kill_conn, self._slots)
+                self.release(kill_conn)
+
+    def drop_replication_slots(self, conn, slots, timeout=5.0):
+        """Drop the replication *slots* once they are no more active.
+
+        Wait for the slots to be released by the closed connections polling
+        with an exponential backoff. Terminate the walsenders still holding
+        them after *timeout* seconds. Drop all the slots with one statement.
+        """
+        conn.autocommit = True
+        cur = conn.cursor()
+        # active_pid is only available from PG 9.5
+        pid = conn.info.server_version >= 90500 and "active_pid" or "null::int"
+        delay = 0.001
+        deadline = time.time() + timeout
+        terminated = False
+        while True:
+            cur.execute(
+                "SELECT %s FROM pg_replication_slots"
+                " WHERE active AND slot_name = ANY(%%s)" % pid,
+                (slots,),
+            )
+            pids = [r[0] for r in cur if r[0] is not None]
+            if not cur.rowcount:
+                break
+            if time.time() >= deadline:
+                if terminated or not pids:
+                    raise Exception("replication slots still active: %s" % slots)
+                cur.execute(
+                    "SELECT pg_terminate_backend(pid) FROM unnest(%s) pid", (pids,)
+                )
+                terminated = True
+                deadline = time.time() + timeout
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+        cur.execute(
+            """SELECT pg_drop_replication_slot(slot_name) FROM pg_replication_slots
+            WHERE slot_name = ANY(%s)""",
+            (slots,),
+        )
 
     def create_replication_slot(self, cur, slot_name=testconfig.repl_slot, **kwargs):
         cur.create_replication_slot(slot_name, **kwargs)
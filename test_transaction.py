@@ -109,34 +109,25 @@ class DeadlockSerializationTests(ConnectingTestCase):
     def setUp(self):
         ConnectingTestCase.setUp(self)
 
+        # The tests commit from concurrent connections, so they can't use
+        # shared tables in a transaction rolled back at the end: at least
+        # create the sample data in a single round trip.
         curs = self.conn.cursor()
-        # Drop table if it already exists
-        try:
-            curs.execute("DROP TABLE table1")
-            self.conn.commit()
-        except psycopg2.DatabaseError:
-            self.conn.rollback()
-        try:
-            curs.execute("DROP TABLE table2")
-            self.conn.commit()
-        except psycopg2.DatabaseError:
-            self.conn.rollback()
-        # Create sample data
         curs.execute(
             """
+            DROP TABLE IF EXISTS table1, table2;
             CREATE TABLE table1 (
                 id int PRIMARY KEY,
-                name text)
+                name text);
+            INSERT INTO table1 VALUES (1, 'hello');
+            CREATE TABLE table2 (id int PRIMARY KEY)
         """
         )
-        curs.execute("INSERT INTO table1 VALUES (1, 'hello')")
-        curs.execute("CREATE TABLE table2 (id int PRIMARY KEY)")
         self.conn.commit()
 
     def tearDown(self):
         curs = self.conn.cursor()
-        curs.execute("DROP TABLE table1")
-        curs.execute("DROP TABLE table2")
+        curs.execute("DROP TABLE table1, table2")
         self.conn.commit()
 
         ConnectingTestCase.tearDown(self)
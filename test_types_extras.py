@@ -30,6 +30,7 @@ from .testutils import (
     text_type,
     skip_if_no_uuid,
     skip_before_postgres,
+    server_caps,
     ConnectingTestCase,
     py3_raises_typeerror,
     slow,
@@ -161,8 +162,7 @@ class TypesExtrasTests(ConnectingTestCase):
 def skip_if_no_hstore(f):
     @wraps(f)
     def skip_if_no_hstore_(self):
-        oids = HstoreAdapter.get_oids(self.conn)
-        if oids is None or not oids[0]:
+        if not server_caps(self.conn).has_hstore:
             return self.skipTest("hstore not available in test database")
         return f(self)
 
@@ -834,9 +834,7 @@ def skip_if_no_json_type(f):
 
     @wraps(f)
     def skip_if_no_json_type_(self):
-        curs = self.conn.cursor()
-        curs.execute("select oid from pg_type where typname = 'json'")
-        if not curs.fetchone():
+        if not server_caps(self.conn).has_json:
             return self.skipTest("json not available in test database")
 
         return f(self)
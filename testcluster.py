@@ -0,0 +1,155 @@
+# testcluster.py - throw-away PostgreSQL cluster to run the tests against
+#
+# Copyright (C) 2020 The Psycopg Team
+#
+# psycopg2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# psycopg2 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+# License for more details.
+
+"""Create a PostgreSQL cluster for the test session and destroy it at exit.
+
+The cluster is created in a tmpfs directory where available and configured for
+speed rather than durability. It is enabled by "PSYCOPG2_TESTDB_EPHEMERAL":
+see testconfig.py. The PostgreSQL programs are looked for in
+"PSYCOPG2_TESTDB_PGBIN", then in the ``pg_config --bindir`` directory, then
+in the PATH.
+"""
+
+import os
+import sys
+import atexit
+import shutil
+import socket
+import tempfile
+import subprocess as sp
+
+# Settings making the cluster fast and able to run all the tests
+SETTINGS = {
+    "fsync": "off",
+    "synchronous_commit": "off",
+    "full_page_writes": "off",
+    "max_prepared_transactions": "10",
+    "wal_level": "logical",
+    "max_wal_senders": "10",
+    "max_replication_slots": "10",
+    "listen_addresses": "127.0.0.1",
+}
+
+
+class EphemeralCluster(object):
+    """A PostgreSQL cluster living as long as the test session."""
+
+    def __init__(self, dbname):
+        self.dbname = dbname
+        self.host = "127.0.0.1"
+        self.port = None
+        self.basedir = None
+        self.bindir = find_bindir()
+
+    @property
+    def datadir(self):
+        return os.path.join(self.basedir, "data")
+
+    def start(self):
+        """Create and start the cluster; create the test database in it."""
+        if hasattr(os, "geteuid") and os.geteuid() == 0:
+            raise RuntimeError("PostgreSQL can't run as root: can't create a cluster")
+
+        shm = "/dev/shm"
+        parent = shm if os.access(shm, os.W_OK) else None
+        self.basedir = tempfile.mkdtemp(prefix="psycopg2_test_", dir=parent)
+        atexit.register(self.destroy)
+
+        self._run("initdb", "-D", self.datadir, "-E", "UTF8", "-A", "trust", "-N")
+
+        self.port = find_free_port(self.host)
+        opts = ["-p %d" % self.port, "-k %s" % self.basedir]
+        opts.extend("-c %s=%s" % item for item in sorted(SETTINGS.items()))
+        self._run(
+            "pg_ctl",
+            "start",
+            "-w",
+            "-D",
+            self.datadir,
+            "-l",
+            os.path.join(self.basedir, "postgresql.log"),
+            "-o",
+            " ".join(opts),
+        )
+
+        self._create_database()
+
+    def destroy(self):
+        """Stop the cluster and remove its files."""
+        if self.basedir is None:
+            return
+
+        if os.path.exists(os.path.join(self.datadir, "postmaster.pid")):
+            try:
+                self._run("pg_ctl", "stop", "-D", self.datadir, "-m", "immediate")
+            except Exception as e:
+                sys.stderr.write("error stopping the test cluster: %s\n" % e)
+
+        shutil.rmtree(self.basedir, ignore_errors=True)
+        self.basedir = None
+
+    def _create_database(self):
+        import psycopg2
+
+        conn = psycopg2.connect(host=self.host, port=self.port, dbname="postgres")
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute('CREATE DATABASE "%s"' % self.dbname.replace('"', '""'))
+        conn.close()
+
+        # Install hstore if available, otherwise its tests will be skipped
+        conn = psycopg2.connect(host=self.host, port=self.port, dbname=self.dbname)
+        conn.autocommit = True
+        cur = conn.cursor()
+        try:
+            cur.execute("CREATE EXTENSION hstore")
+        except psycopg2.Error:
+            pass
+        conn.close()
+
+    def _run(self, prog, *args):
+        cmdline = [os.path.join(self.bindir, prog) if self.bindir else prog]
+        cmdline.extend(args)
+        p = sp.Popen(cmdline, stdout=sp.PIPE, stderr=sp.STDOUT)
+        out = p.communicate()[0]
+        if p.returncode:
+            raise RuntimeError(
+                "command failed: %s\n%s"
+                % (" ".join(cmdline), out.decode("utf8", "replace"))
+            )
+
+
+def find_bindir():
+    """Return the directory of the PostgreSQL programs, None to use the PATH."""
+    bindir = os.environ.get("PSYCOPG2_TESTDB_PGBIN")
+    if bindir:
+        return bindir
+
+    try:
+        out = sp.check_output(["pg_config", "--bindir"], stderr=sp.STDOUT)
+    except (OSError, sp.CalledProcessError):
+        return None
+
+    bindir = out.decode("utf8").strip()
+    if os.path.exists(os.path.join(bindir, "initdb")):
+        return bindir
+
+
+def find_free_port(host):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
@@ -8,6 +8,26 @@ dbport = os.environ.get("PSYCOPG2_TESTDB_PORT", None)
 dbuser = os.environ.get("PSYCOPG2_TESTDB_USER", None)
 dbpass = os.environ.get("PSYCOPG2_TESTDB_PASSWORD", None)
 
+# Run the tests on a throw-away cluster created for the session, with the
+# settings needed by the tpc and replication tests (see testcluster.py).
+cluster = None
+if os.environ.get("PSYCOPG2_TESTDB_EPHEMERAL", "0") != "0":
+    from .testcluster import EphemeralCluster
+
+    cluster = EphemeralCluster(dbname)
+    cluster.start()
+    dbhost = cluster.host
+    dbport = str(cluster.port)
+    dbuser = dbpass = None
+
+    # Subprocesses (e.g. the parallel runner workers) use the same cluster
+    del os.environ["PSYCOPG2_TESTDB_EPHEMERAL"]
+    os.environ["PSYCOPG2_TESTDB_HOST"] = dbhost
+    os.environ["PSYCOPG2_TESTDB_PORT"] = dbport
+    os.environ.pop("PSYCOPG2_TESTDB_USER", None)
+    os.environ.pop("PSYCOPG2_TESTDB_PASSWORD", None)
+    os.environ.setdefault("PSYCOPG2_TEST_REPL_DSN", "")
+
 # Check if we want to test psycopg's green path.
 green = os.environ.get("PSYCOPG2_TEST_GREEN", None)
 if green:
@@ -42,3 +62,11 @@ if repl_dsn == "":
     repl_dsn = dsn
 
 repl_slot = os.environ.get("PSYCOPG2_TEST_REPL_SLOT", "psycopg2_test_slot")
+
+# Reuse connections to the test database across tests, resetting them in
+# between (see testutils.ConnectionPool).
+pool = os.environ.get("PSYCOPG2_TEST_POOL", "0") != "0"
+
+# File where to save the test server capabilities, to avoid probing them again
+# on the following runs (see testutils.server_caps).
+caps_cache = os.environ.get("PSYCOPG2_TEST_CAPS_CACHE", None)
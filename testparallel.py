@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+# testparallel.py - run the test suite on several processes
+#
+# Copyright (C) 2020 The Psycopg Team
+#
+# psycopg2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# psycopg2 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+# License for more details.
+
+"""Run the test suite in parallel.
+
+The tests are split across worker processes, each one running against its own
+database, created from the test database as template, so that tests creating
+fixed-name tables don't collide. The results are merged in a single report.
+
+Usage::
+
+    python -m tests.testparallel [-j N] [-v] [name ...]
+
+where *name* is a test module, class or method relative to the package (e.g.
+``test_connection.ConnectionTests``) or a pattern matching test ids. The
+template database must not be in use by other sessions while the workers
+databases are created.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import unittest
+import subprocess as sp
+from multiprocessing import cpu_count
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import make_dsn
+
+from . import testconfig
+
+
+def main():
+    opt = parse_cmdline()
+    if opt.worker:
+        return run_worker(opt.input, opt.output)
+
+    ids = collect_test_ids(opt.names)
+    chunks = split_ids(ids, opt.jobs)
+    dbnames = ["%s_%d_%d" % (opt.template, os.getpid(), i) for i in range(len(chunks))]
+
+    create_databases(opt.template, dbnames)
+    tmpdir = tempfile.mkdtemp(prefix="psycopg2_test_")
+    try:
+        t0 = time.time()
+        records = run_workers(chunks, dbnames, tmpdir)
+        elapsed = time.time() - t0
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        drop_databases(dbnames)
+
+    result = merge_results(records, opt.verbosity)
+    print_report(result, elapsed)
+    return 0 if result.wasSuccessful() else 1
+
+
+def parse_cmdline():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "names", nargs="*", help="tests to run (default: the whole suite)"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=cpu_count(),
+        help="number of worker processes [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--template",
+        default=testconfig.dbname,
+        help="database to clone for the workers [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="verbosity",
+        action="store_const",
+        const=2,
+        default=1,
+        help="list the tests run",
+    )
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--input", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def collect_test_ids(names):
+    """Return the ids of the tests to run."""
+    package = sys.modules[__package__]
+    suite = package.test_suite(names or None)
+    return [test.id() for test in package.iter_tests(suite)]
+
+
+def split_ids(ids, njobs):
+    """Split the test ids in at most *njobs* chunks of similar size.
+
+    Tests of the same class are kept together, so that class fixtures are set
+    up only once and tests don't race against each other on the same objects.
+    """
+    classes = {}
+    for id in ids:
+        classes.setdefault(id.rsplit(".", 1)[0], []).append(id)
+
+    chunks = [[] for i in range(max(1, min(njobs, len(classes))))]
+    for tests in sorted(classes.values(), key=len, reverse=True):
+        min(chunks, key=len).extend(tests)
+
+    return [c for c in chunks if c]
+
+
+def admin_connect():
+    """Connect to the maintenance database of the test server."""
+    conn = psycopg2.connect(make_dsn(testconfig.dsn, dbname="postgres"))
+    conn.autocommit = True
+    return conn
+
+
+def create_databases(template, dbnames):
+    conn = admin_connect()
+    try:
+        cur = conn.cursor()
+        for dbname in dbnames:
+            cur.execute(
+                sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(dbname))
+            )
+            cur.execute(
+                sql.SQL("CREATE DATABASE {} TEMPLATE {}").format(
+                    sql.Identifier(dbname), sql.Identifier(template)
+                )
+            )
+    finally:
+        conn.close()
+
+
+def drop_databases(dbnames):
+    conn = admin_connect()
+    try:
+        cur = conn.cursor()
+        for dbname in dbnames:
+            cur.execute(
+                sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(dbname))
+            )
+    finally:
+        conn.close()
+
+
+def run_workers(chunks, dbnames, tmpdir):
+    """Run every chunk of tests in a worker; return the records of all the tests."""
+    pkgdir = os.path.dirname(os.path.abspath(sys.modules[__package__].__file__))
+    pypath = os.path.dirname(pkgdir)
+    if os.environ.get("PYTHONPATH"):
+        pypath += os.pathsep + os.environ["PYTHONPATH"]
+
+    procs = []
+    for i, (chunk, dbname) in enumerate(zip(chunks, dbnames)):
+        fnin = os.path.join(tmpdir, "input-%d.json" % i)
+        fnout = os.path.join(tmpdir, "output-%d.json" % i)
+        with open(fnin, "w") as f:
+            json.dump(chunk, f)
+
+        env = dict(os.environ)
+        env["PYTHONPATH"] = pypath
+        env["PSYCOPG2_TESTDB"] = dbname
+        # replication slots are global to the server: don't share them
+        env["PSYCOPG2_TEST_REPL_SLOT"] = "%s_%d" % (testconfig.repl_slot, i)
+        if testconfig.repl_dsn == testconfig.dsn:
+            env["PSYCOPG2_TEST_REPL_DSN"] = ""
+
+        cmdline = [sys.executable, "-m", "%s.testparallel" % __package__, "--worker"]
+        cmdline += ["--input", fnin, "--output", fnout]
+        procs.append((sp.Popen(cmdline, env=env), chunk, fnout))
+
+    records = []
+    for proc, chunk, fnout in procs:
+        proc.wait()
+        try:
+            with open(fnout) as f:
+                records.extend(json.load(f))
+        except (IOError, ValueError):
+            # the worker died without reporting: blame all its tests
+            for id in chunk:
+                records.append(
+                    {
+                        "id": id,
+                        "outcome": "error",
+                        "details": "worker exited with status %s" % proc.returncode,
+                    }
+                )
+
+    return records
+
+
+def run_worker(fnin, fnout):
+    with open(fnin) as f:
+        ids = json.load(f)
+
+    suite = unittest.TestSuite()
+    for id in ids:
+        suite.addTests(unittest.defaultTestLoader.loadTestsFromName(id))
+
+    result = RecordingResult()
+    suite.run(result)
+
+    with open(fnout, "w") as f:
+        json.dump(result.records, f)
+
+    return 0
+
+
+class RecordingResult(unittest.TestResult):
+    """A test result storing the outcome of every test as a json-able record."""
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingResult, self).__init__(*args, **kwargs)
+        self.records = []
+
+    def _record(self, test, outcome, details=None):
+        self.records.append({"id": test.id(), "outcome": outcome, "details": details})
+
+    def addSuccess(self, test):
+        super(RecordingResult, self).addSuccess(test)
+        self._record(test, "success")
+
+    def addError(self, test, err):
+        super(RecordingResult, self).addError(test, err)
+        self._record(test, "error", self.errors[-1][1])
+
+    def addFailure(self, test, err):
+        super(RecordingResult, self).addFailure(test, err)
+        self._record(test, "failure", self.failures[-1][1])
+
+    def addSkip(self, test, reason):
+        super(RecordingResult, self).addSkip(test, reason)
+        self._record(test, "skip", reason)
+
+    def addExpectedFailure(self, test, err):
+        super(RecordingResult, self).addExpectedFailure(test, err)
+        self._record(test, "expectedFailure", self.expectedFailures[-1][1])
+
+    def addUnexpectedSuccess(self, test):
+        super(RecordingResult, self).addUnexpectedSuccess(test)
+        self._record(test, "unexpectedSuccess")
+
+
+class RemoteTest(object):
+    """Stand-in for a test run in a worker, good enough to be reported."""
+
+    def __init__(self, id):
+        self._id = id
+
+    def id(self):
+        return self._id
+
+    def shortDescription(self):
+        return None
+
+    def __str__(self):
+        cls, meth = self._id.rsplit(".", 1)
+        return "%s (%s)" % (meth, cls)
+
+
+def merge_results(records, verbosity=1):
+    """Build a single test result out of the workers records."""
+    result = unittest.TextTestResult(
+        unittest.runner._WritelnDecorator(sys.stderr), True, verbosity
+    )
+    for rec in sorted(records, key=lambda r: r["id"]):
+        test = RemoteTest(rec["id"])
+        outcome = rec["outcome"]
+        result.testsRun += 1
+        if outcome == "error":
+            result.errors.append((test, rec["details"]))
+        elif outcome == "failure":
+            result.failures.append((test, rec["details"]))
+        elif outcome == "skip":
+            result.skipped.append((test, rec["details"]))
+        elif outcome == "expectedFailure":
+            result.expectedFailures.append((test, rec["details"]))
+        elif outcome == "unexpectedSuccess":
+            result.unexpectedSuccesses.append(test)
+
+        if verbosity > 1:
+            result.stream.writeln("%s ... %s" % (test, outcome))
+
+    return result
+
+
+def print_report(result, elapsed):
+    result.printErrors()
+    stream = result.stream
+    stream.writeln(result.separator2)
+    stream.writeln(
+        "Ran %d test%s in %.3fs"
+        % (result.testsRun, result.testsRun != 1 and "s" or "", elapsed)
+    )
+    stream.writeln()
+
+    infos = []
+    if result.failures:
+        infos.append("failures=%d" % len(result.failures))
+    if result.errors:
+        infos.append("errors=%d" % len(result.errors))
+    if result.skipped:
+        infos.append("skipped=%d" % len(result.skipped))
+    if result.expectedFailures:
+        infos.append("expected failures=%d" % len(result.expectedFailures))
+    if result.unexpectedSuccesses:
+        infos.append("unexpected successes=%d" % len(result.unexpectedSuccesses))
+
+    status = result.wasSuccessful() and "OK" or "FAILED"
+    if infos:
+        status += " (%s)" % ", ".join(infos)
+    stream.writeln(status)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+
+# testtiming.py - measure the time spent by every test
+#
+# Copyright (C) 2020 The Psycopg Team
+#
+# psycopg2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# psycopg2 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+# License for more details.
+
+"""Run the test suite measuring every test.
+
+The time spent in setUp, in the test and in tearDown, the number of round
+trips to the server, of statements and of bytes exchanged are recorded for
+every test. At the end the slowest tests are reported, together with the ones
+slower than a threshold and not marked as `@slow` yet.
+
+Usage::
+
+    python -m tests.testtiming [--report FILE] [--top N] [--slow-threshold S]
+        [name ...]
+
+The report is written in json or csv format according to the file extension.
+
+With ``--history FILE`` the durations are appended to a history file, together
+with the git revision and the server version. With ``--compare N`` too, every
+test is compared with its previous N runs against the same server version:
+tests significantly slower than their history make the run fail. Their
+durations are marked as regressions in the history, so that they don't become
+the baseline of the following runs.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import unittest
+import subprocess as sp
+from functools import wraps
+
+from . import testutils
+
+
+class TimingTestResult(unittest.TextTestResult):
+    """A test result recording the duration of every test.
+
+    The measures are available as a list of dicts in the `records` attribute.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TimingTestResult, self).__init__(*args, **kwargs)
+        self.records = []
+        self._record = None
+
+    def startTest(self, test):
+        super(TimingTestResult, self).startTest(test)
+        self._record = rec = {
+            "id": test.id(),
+            "setup": 0.0,
+            "test": 0.0,
+            "teardown": 0.0,
+            "total": 0.0,
+            "roundtrips": 0,
+            "statements": 0,
+            "bytes_out": 0,
+            "bytes_in": 0,
+            "outcome": None,
+            "slow": False,
+        }
+
+        name = getattr(test, "_testMethodName", None)
+        if name is not None:
+            meth = getattr(test, name)
+            rec["slow"] = getattr(meth, "slow", False)
+            test.setUp = self._timed(test.setUp, "setup")
+            test.tearDown = self._timed(test.tearDown, "teardown")
+            setattr(test, name, self._timed(meth, "test"))
+
+        rec["_stats"] = testutils.stats.snapshot()
+        rec["_t0"] = time.time()
+
+    def stopTest(self, test):
+        rec = self._record
+        rec["total"] = time.time() - rec.pop("_t0")
+        before = rec.pop("_stats")
+        for k, v in testutils.stats.snapshot().items():
+            rec[k] = v - before[k]
+
+        # drop the wrappers installed by startTest
+        for name in ("setUp", "tearDown", getattr(test, "_testMethodName", None)):
+            if name is not None and name in test.__dict__:
+                del test.__dict__[name]
+
+        self.records.append(rec)
+        self._record = None
+        super(TimingTestResult, self).stopTest(test)
+
+    def _timed(self, f, phase):
+        @wraps(f)
+        def timed(*args, **kwargs):
+            t0 = time.time()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                self._record[phase] += time.time() - t0
+
+        return timed
+
+    def _set_outcome(self, test, outcome):
+        if self._record is not None and self._record["id"] == test.id():
+            self._record["outcome"] = outcome
+
+    def addSuccess(self, test):
+        super(TimingTestResult, self).addSuccess(test)
+        self._set_outcome(test, "success")
+
+    def addError(self, test, err):
+        super(TimingTestResult, self).addError(test, err)
+        self._set_outcome(test, "error")
+
+    def addFailure(self, test, err):
+        super(TimingTestResult, self).addFailure(test, err)
+        self._set_outcome(test, "failure")
+
+    def addSkip(self, test, reason):
+        super(TimingTestResult, self).addSkip(test, reason)
+        self._set_outcome(test, "skip")
+
+    def addExpectedFailure(self, test, err):
+        super(TimingTestResult, self).addExpectedFailure(test, err)
+        self._set_outcome(test, "expectedFailure")
+
+    def addUnexpectedSuccess(self, test):
+        super(TimingTestResult, self).addUnexpectedSuccess(test)
+        self._set_outcome(test, "unexpectedSuccess")
+
+
+def slowest(records, n):
+    """Return the *n* slowest tests records."""
+    return sorted(records, key=lambda r: r["total"], reverse=True)[:n]
+
+
+def suggest_slow(records, threshold):
+    """Return the records of the tests slower than *threshold* seconds.
+
+    Tests already marked as `@slow` or skipped are not returned.
+    """
+    return [
+        r
+        for r in slowest(records, len(records))
+        if r["total"] >= threshold and not r["slow"] and r["outcome"] != "skip"
+    ]
+
+
+FIELDS = [
+    "id",
+    "outcome",
+    "slow",
+    "setup",
+    "test",
+    "teardown",
+    "total",
+    "roundtrips",
+    "statements",
+    "bytes_out",
+    "bytes_in",
+]
+
+
+def write_report(filename, records, top=20, threshold=None):
+    """Write the test measures into *filename* as json or csv."""
+    if filename.endswith(".csv"):
+        with open(filename, "w") as f:
+            writer = csv.DictWriter(f, FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for rec in records:
+                writer.writerow(rec)
+        return
+
+    data = {"tests": records, "slowest": [r["id"] for r in slowest(records, top)]}
+    if threshold is not None:
+        data["suggest_slow"] = [r["id"] for r in suggest_slow(records, threshold)]
+
+    with open(filename, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def print_summary(stream, records, top=20, threshold=None):
+    stream.write("\nSlowest %d tests:\n" % top)
+    for rec in slowest(records, top):
+        stream.write(
+            "%8.3fs %5d rt  %s%s\n"
+            % (
+                rec["total"],
+                rec["roundtrips"],
+                rec["id"],
+                rec["slow"] and " (slow)" or "",
+            )
+        )
+
+    if threshold is not None:
+        suggested = suggest_slow(records, threshold)
+        if suggested:
+            stream.write(
+                "\nTests slower than %ss which could be marked @slow:\n" % threshold
+            )
+            for rec in suggested:
+                stream.write("%8.3fs  %s\n" % (rec["total"], rec["id"]))
+
+
+def git_revision():
+    """Return the git revision of the tests, "unknown" if not available."""
+    try:
+        out = sp.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=sp.STDOUT,
+        )
+    except (OSError, sp.CalledProcessError):
+        return "unknown"
+    return out.decode("ascii").strip()
+
+
+def load_history(filename):
+    """Return the records in the history file *filename*."""
+    rv = []
+    try:
+        f = open(filename)
+    except IOError:
+        return rv
+
+    with f:
+        for line in f:
+            if line.strip():
+                rv.append(json.loads(line))
+
+    return rv
+
+
+def append_history(filename, records, revision, server_version, regressed=()):
+    """Append the successful tests in *records* to the history file *filename*.
+
+    The file contains a json object per line. The entries of the tests whose
+    id is in *regressed* are marked, and ignored by `find_regressions()`.
+    """
+    run = time.strftime("%Y-%m-%dT%H:%M:%S")
+    with open(filename, "a") as f:
+        for rec in records:
+            if rec["outcome"] != "success":
+                continue
+            entry = {
+                "run": run,
+                "revision": revision,
+                "server_version": server_version,
+                "id": rec["id"],
+                "total": rec["total"],
+                "roundtrips": rec["roundtrips"],
+            }
+            if rec["id"] in regressed:
+                entry["regressed"] = True
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+
+def find_regressions(
+    history, records, server_version, runs=5, max_ratio=1.5, min_delta=0.05
+):
+    """Return the tests significantly slower than in their previous *runs*.
+
+    A test is a regression if its duration is more than 3 standard deviations
+    above the mean of its history and at least *max_ratio* times slower, by at
+    least *min_delta* seconds (to ignore the noise of very fast tests). At
+    least 3 previous runs are needed to judge a test. The runs marked as
+    regressions are not part of the history.
+
+    Return a list of (record, mean, stdev) tuples.
+    """
+    past = {}
+    for entry in history:
+        if entry["server_version"] == server_version and not entry.get("regressed"):
+            past.setdefault(entry["id"], []).append(entry["total"])
+
+    rv = []
+    for rec in records:
+        if rec["outcome"] != "success":
+            continue
+        durations = past.get(rec["id"], [])[-runs:]
+        if len(durations) < 3:
+            continue
+
+        mean = sum(durations) / len(durations)
+        stdev = (sum((d - mean) ** 2 for d in durations) / (len(durations) - 1)) ** 0.5
+        # a perfectly stable history would make any change significant
+        stdev = max(stdev, mean * 0.05)
+
+        cur = rec["total"]
+        if (
+            cur > mean + 3 * stdev
+            and cur >= mean * max_ratio
+            and cur - mean >= min_delta
+        ):
+            rv.append((rec, mean, stdev))
+
+    return rv
+
+
+def print_regressions(stream, regressions):
+    stream.write("\nPERFORMANCE REGRESSIONS:\n")
+    for rec, mean, stdev in regressions:
+        stream.write(
+            "%8.3fs (was %.3fs +/- %.3fs, %.1fx)  %s\n"
+            % (rec["total"], mean, stdev, rec["total"] / mean, rec["id"])
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "names", nargs="*", help="tests to run (default: the whole suite)"
+    )
+    parser.add_argument("--report", help="file to write the measures to")
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=20,
+        help="number of slowest tests to show [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--slow-threshold",
+        type=float,
+        metavar="S",
+        help="suggest to mark as slow the tests taking more than S seconds",
+    )
+    parser.add_argument(
+        "--history", metavar="FILE", help="append the durations to this file"
+    )
+    parser.add_argument(
+        "--compare",
+        type=int,
+        default=0,
+        metavar="N",
+        help="fail if tests are slower than in the previous N runs in the history",
+    )
+    parser.add_argument(
+        "--max-ratio",
+        type=float,
+        default=1.5,
+        metavar="R",
+        help="slowdown ratio tolerated by --compare [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="verbosity",
+        action="store_const",
+        const=2,
+        default=1,
+        help="list the tests run",
+    )
+    opt = parser.parse_args()
+
+    # count the round trips of every test, not only of the ones checking them
+    testutils.ConnectingTestCase.counting = True
+    suite = sys.modules[__package__].test_suite(opt.names or None)
+    runner = unittest.TextTestRunner(
+        verbosity=opt.verbosity, resultclass=TimingTestResult
+    )
+    result = runner.run(suite)
+
+    print_summary(sys.stderr, result.records, opt.top, opt.slow_threshold)
+    if opt.report:
+        write_report(opt.report, result.records, opt.top, opt.slow_threshold)
+
+    regressions = []
+    if opt.history:
+        server_version = testutils.server_caps().server_version
+        if opt.compare:
+            regressions = find_regressions(
+                load_history(opt.history),
+                result.records,
+                server_version,
+                runs=opt.compare,
+                max_ratio=opt.max_ratio,
+            )
+            if regressions:
+                print_regressions(sys.stderr, regressions)
+
+        append_history(
+            opt.history,
+            result.records,
+            git_revision(),
+            server_version,
+            regressed=set(rec["id"] for rec, mean, stdev in regressions),
+        )
+
+    return 0 if result.wasSuccessful() and not regressions else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
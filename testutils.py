@@ -27,11 +27,20 @@ import re
 import os
 import sys
 import types
+import json
+import atexit
+import socket
+import struct
+import hashlib
+import datetime
+import time
 import ctypes
+import tempfile
 import select
 import platform
 import unittest
 from functools import wraps
+from contextlib import contextmanager
 from ctypes.util import find_library
 
 import psycopg2
@@ -39,7 +48,7 @@ import psycopg2.errors
 import psycopg2.extensions
 from psycopg2.compat import PY2, PY3, text_type
 
-from .testconfig import green, dsn, repl_dsn
+from .testconfig import green, dsn, repl_dsn, pool, caps_cache
 
 # Python 2/3 compatibility
 
@@ -84,24 +93,450 @@ def assertDsnEqual(self, dsn1, dsn2, msg=None):
 unittest.TestCase.assertDsnEqual = assertDsnEqual
 
 
+class ConnectionStats(object):
+    """Counters of the activity of the `CountingConnection` objects.
+
+    *bytes_out* counts the bytes of the statements sent; *bytes_in* counts the
+    bytes received from the server, but only on TCP connections on Linux.
+    """
+
+    _fields = ("roundtrips", "statements", "bytes_out", "bytes_in")
+
+    def __init__(self):
+        for k in self._fields:
+            setattr(self, k, 0)
+
+    def snapshot(self):
+        return dict((k, getattr(self, k)) for k in self._fields)
+
+
+# The activity of all the `CountingConnection` objects
+stats = ConnectionStats()
+
+
+def count_statements(query):
+    """Return the number of statements in the bytes string *query*.
+
+    Statements are separated by semicolons outside quotes and comments.
+    Dollar-quoted strings are not recognised.
+    """
+    rv = 0
+    seen = False
+    i = 0
+    n = len(query)
+    while i < n:
+        c = query[i : i + 1]
+        if c in (b"'", b'"'):
+            i = query.find(c, i + 1)
+            if i < 0:
+                break
+            seen = True
+        elif c == b"-" and query[i : i + 2] == b"--":
+            i = query.find(b"\n", i)
+            if i < 0:
+                break
+        elif c == b";":
+            if seen:
+                rv += 1
+            seen = False
+        elif not c.isspace():
+            seen = True
+        i += 1
+
+    if seen:
+        rv += 1
+    return rv
+
+
+def _tcp_bytes_received(conn):
+    """Return the bytes received so far on the socket of *conn*.
+
+    Return None if the number is not available (not Linux, not TCP).
+    """
+    if not sys.platform.startswith("linux") or conn.closed:
+        return None
+
+    sock = socket.fromfd(conn.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, _TCP_INFO, 256)
+    except socket.error:
+        return None
+    finally:
+        sock.close()
+
+    # tcpi_bytes_received in struct tcp_info, available from Linux 4.1
+    if len(info) < 136:
+        return None
+    return struct.unpack_from("Q", info, 128)[0]
+
+
+_TCP_INFO = getattr(socket, "TCP_INFO", 11)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    """A connection counting its activity in `stats`.
+
+    The cursors are counted only if created with the default cursor factory.
+    The count is an estimate: it doesn't include large objects operations and
+    iteration on named cursors.
+
+    Use it as *connection_factory* to make a connection accountable in the
+    tests using `max_roundtrips()` or `ConnectingTestCase.assertRoundtrips()`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CountingConnection, self).__init__(*args, **kwargs)
+        self._bytes_in = None
+        if not self.async_:
+            self._bytes_in = _tcp_bytes_received(self)
+
+    def cursor(self, *args, **kwargs):
+        if "cursor_factory" not in kwargs and len(args) < 2:
+            if self.cursor_factory is None:
+                kwargs["cursor_factory"] = CountingCursor
+        return super(CountingConnection, self).cursor(*args, **kwargs)
+
+    def _count(self, statement=None):
+        """Count a round trip, optionally sending *statement*."""
+        stats.roundtrips += 1
+        if statement is not None:
+            stats.statements += 1
+            stats.bytes_out += len(statement)
+
+    def _count_received(self):
+        if self._bytes_in is None:
+            return
+        received = _tcp_bytes_received(self)
+        if received is not None:
+            stats.bytes_in += received - self._bytes_in
+            self._bytes_in = received
+
+    def _count_begin(self):
+        # psycopg sends BEGIN on its own before the first statement
+        if (
+            not self.autocommit
+            and self.info.transaction_status
+            == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        ):
+            self._count(b"BEGIN")
+
+    def _counted(self, f, statement, *args):
+        self._count(statement)
+        try:
+            return f(*args)
+        finally:
+            self._count_received()
+
+    def commit(self):
+        if self.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            self._count(b"COMMIT")
+        try:
+            return super(CountingConnection, self).commit()
+        finally:
+            self._count_received()
+
+    def rollback(self):
+        if self.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            self._count(b"ROLLBACK")
+        try:
+            return super(CountingConnection, self).rollback()
+        finally:
+            self._count_received()
+
+    def tpc_prepare(self):
+        return self._counted(
+            super(CountingConnection, self).tpc_prepare, b"PREPARE TRANSACTION"
+        )
+
+    def tpc_commit(self, *args):
+        return self._counted(
+            super(CountingConnection, self).tpc_commit, b"COMMIT PREPARED", *args
+        )
+
+    def tpc_rollback(self, *args):
+        return self._counted(
+            super(CountingConnection, self).tpc_rollback, b"ROLLBACK PREPARED", *args
+        )
+
+    def tpc_recover(self):
+        self._count_begin()
+        return self._counted(
+            super(CountingConnection, self).tpc_recover,
+            b"SELECT FROM pg_prepared_xacts",
+        )
+
+    def set_client_encoding(self, encoding):
+        return self._counted(
+            super(CountingConnection, self).set_client_encoding,
+            b"SET client_encoding",
+            encoding,
+        )
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """A cursor counting its activity in `stats`."""
+
+    def _counted(self, f, *args, **kwargs):
+        conn = self.connection
+        counting = isinstance(conn, CountingConnection)
+        if counting:
+            conn._count_begin()
+        stats.roundtrips += 1
+        query = self.query
+        try:
+            return f(*args, **kwargs)
+        finally:
+            if self.query is not None and self.query is not query:
+                stats.statements += count_statements(self.query)
+                stats.bytes_out += len(self.query)
+            if counting:
+                conn._count_received()
+
+    def execute(self, query, vars=None):
+        return self._counted(super(CountingCursor, self).execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        conn = self.connection
+        counting = isinstance(conn, CountingConnection)
+        if counting:
+            conn._count_begin()
+        self._sent = False
+        try:
+            return super(CountingCursor, self).executemany(
+                query, self._counting(vars_list)
+            )
+        finally:
+            self._count_sent()
+            if counting:
+                conn._count_received()
+
+    def _counting(self, vars_list):
+        for vars in vars_list:
+            # the previous item has been executed when the next is requested
+            self._count_sent()
+            stats.roundtrips += 1
+            stats.statements += 1
+            self._sent = True
+            yield vars
+
+    def _count_sent(self):
+        if self._sent and self.query is not None:
+            stats.bytes_out += len(self.query)
+        self._sent = False
+
+    def callproc(self, procname, parameters=None):
+        return self._counted(super(CountingCursor, self).callproc, procname, parameters)
+
+    def copy_from(self, *args, **kwargs):
+        return self._counted(super(CountingCursor, self).copy_from, *args, **kwargs)
+
+    def copy_to(self, *args, **kwargs):
+        return self._counted(super(CountingCursor, self).copy_to, *args, **kwargs)
+
+    def copy_expert(self, *args, **kwargs):
+        return self._counted(super(CountingCursor, self).copy_expert, *args, **kwargs)
+
+    # Named cursors fetch from the server on every call
+
+    def _fetched(self, f, *args, **kwargs):
+        if self.name is None:
+            return f(*args, **kwargs)
+
+        stats.roundtrips += 1
+        stats.statements += 1
+        try:
+            return f(*args, **kwargs)
+        finally:
+            if isinstance(self.connection, CountingConnection):
+                self.connection._count_received()
+
+    def fetchone(self):
+        return self._fetched(super(CountingCursor, self).fetchone)
+
+    def fetchmany(self, *args, **kwargs):
+        return self._fetched(super(CountingCursor, self).fetchmany, *args, **kwargs)
+
+    def fetchall(self):
+        return self._fetched(super(CountingCursor, self).fetchall)
+
+    def scroll(self, *args, **kwargs):
+        return self._fetched(super(CountingCursor, self).scroll, *args, **kwargs)
+
+
+def max_roundtrips(n):
+    """Fail a test if its body performs more than *n* round trips to the server.
+
+    Only the activity of `CountingConnection` objects is accounted for: the
+    test case must set `ConnectingTestCase.counting`. setUp and tearDown are
+    not included.
+    """
+
+    @decorate_all_tests
+    def max_roundtrips_(f):
+        @wraps(f)
+        def max_roundtrips__(self):
+            _check_counting(self)
+            before = stats.roundtrips
+            rv = f(self)
+            done = stats.roundtrips - before
+            if done > n:
+                self.fail("the test used %d round trips, budget was %d" % (done, n))
+            return rv
+
+        return max_roundtrips__
+
+    return max_roundtrips_
+
+
+def _check_counting(test):
+    """Fail *test* if its connection is not counted."""
+    if not isinstance(test.conn, CountingConnection):
+        test.fail("round trips are not counted: set counting = True on the test")
+
+
+class ConnectionPool(object):
+    """A session-wide pool of connections to the test database.
+
+    Connections are reset when returned to the pool so that, when handed out
+    again, they look like a fresh connection to the test using them. A
+    connection which can't be reset is closed and dropped.
+
+    Modules keeping a state per connection which the reset invalidates can
+    register a function to forget it using `add_reset_hook()`.
+    """
+
+    # Functions called with the connections reset
+    _reset_hooks = []
+
+    def __init__(self, dsn, maxidle=8):
+        self.dsn = dsn
+        self.maxidle = maxidle
+        self._idle = []
+        # connections handed out -> their encoding at connection time
+        self._used = {}
+
+    @classmethod
+    def add_reset_hook(cls, hook):
+        """Call *hook(conn)* after resetting a connection, in every pool."""
+        if hook not in cls._reset_hooks:
+            cls._reset_hooks.append(hook)
+
+    def __contains__(self, conn):
+        return conn in self._used
+
+    def getconn(self):
+        while self._idle:
+            conn, encoding = self._idle.pop()
+            if not conn.closed:
+                break
+        else:
+            conn = psycopg2.connect(self.dsn)
+            encoding = conn.encoding
+
+        self._used[conn] = encoding
+        return conn
+
+    def putconn(self, conn):
+        encoding = self._used.pop(conn)
+        if conn.closed:
+            return
+
+        if len(self._idle) >= self.maxidle or not self._reset(conn, encoding):
+            conn.close()
+            return
+
+        self._idle.append((conn, encoding))
+
+    def closeall(self):
+        while self._idle:
+            self._idle.pop()[0].close()
+
+    def _reset(self, conn, encoding):
+        """Bring a connection back to its initial state.
+
+        Return False if the connection is not in a state we can recover from.
+        """
+        ext = psycopg2.extensions
+        if conn.status not in (ext.STATUS_READY, ext.STATUS_BEGIN):
+            # e.g. a prepared two-phase transaction
+            return False
+        if conn.encoding != encoding:
+            return False
+
+        try:
+            if conn.info.transaction_status != ext.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+
+            # DISCARD ALL can't run in a transaction block
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute("RESET SESSION AUTHORIZATION; DISCARD ALL")
+            for hook in self._reset_hooks:
+                hook(conn)
+
+            # RESET ALL may have undone the datestyle set by psycopg on connect
+            if not conn.get_parameter_status("DateStyle").startswith("ISO"):
+                cur.execute("SET DATESTYLE TO 'ISO'")
+            cur.close()
+
+            conn.set_session(
+                isolation_level="DEFAULT",
+                readonly="DEFAULT",
+                deferrable="DEFAULT",
+                autocommit=False,
+            )
+        except psycopg2.Error:
+            return False
+
+        conn.cursor_factory = None
+        conn.notices = []
+        conn.notifies = []
+        conn.string_types.clear()
+        conn.binary_types.clear()
+        return True
+
+
+_pool = None
+
+
+def get_pool():
+    """Return the session-wide connection pool, creating it if needed."""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(dsn)
+        atexit.register(_pool.closeall)
+    return _pool
+
+
 class ConnectingTestCase(unittest.TestCase):
     """A test case providing connections for tests.
 
     A connection for the test is always available as `self.conn`. Others can be
     created with `self.connect()`. All are closed on tearDown.
 
+    If `counting` is true, connections created without a *connection_factory*
+    are instances of `CountingConnection`, so that the tests round trips can be
+    measured, e.g. using `assertRoundtrips()`.
+
+    If "PSYCOPG2_TEST_POOL" is set, connections requested without arguments are
+    taken from a session-wide pool and returned to it on tearDown, instead of
+    being closed. Connections requested with any argument (*dsn*,
+    *connection_factory*, *async_*...), or counted, are always dedicated.
+
     Subclasses needing to customize setUp and tearDown should remember to call
     the base class implementations.
     """
 
+    # Set to True to count the activity of the connections of the test
+    counting = False
+
     def setUp(self):
         self._conns = []
 
     def tearDown(self):
         # close the connections used in the test
-        for conn in self._conns:
-            if not conn.closed:
-                conn.close()
+        for conn in self._conns[:]:
+            self.release(conn)
 
     def assertQuotedEqual(self, first, second, msg=None):
         """Compare two quoted strings disregarding eventual E'' quotes"""
@@ -116,6 +551,20 @@ class ConnectingTestCase(unittest.TestCase):
 
         return self.assertEqual(f(first), f(second), msg)
 
+    @contextmanager
+    def assertRoundtrips(self, n):
+        """Check that the block performs exactly *n* round trips to the server.
+
+        Only the activity of `CountingConnection` objects is accounted for:
+        the test case must set `counting`.
+        """
+        _check_counting(self)
+        before = stats.roundtrips
+        yield
+        done = stats.roundtrips - before
+        if done != n:
+            self.fail("the block used %d round trips, expected %d" % (done, n))
+
     def connect(self, **kwargs):
         try:
             self._conns
@@ -124,14 +573,40 @@ class ConnectingTestCase(unittest.TestCase):
                 "%s (did you forget to call ConnectingTestCase.setUp()?)" % e
             )
 
+        if pool and not kwargs and not self.counting:
+            conn = get_pool().getconn()
+            self._conns.append(conn)
+            return conn
+
         if "dsn" in kwargs:
             conninfo = kwargs.pop("dsn")
         else:
             conninfo = dsn
+        if (
+            self.counting
+            and "connection_factory" not in kwargs
+            and not (kwargs.get("async") or kwargs.get("async_"))
+        ):
+            kwargs["connection_factory"] = CountingConnection
         conn = psycopg2.connect(conninfo, **kwargs)
         self._conns.append(conn)
         return conn
 
+    def release(self, conn):
+        """Dispose of a connection obtained by `connect()`.
+
+        Pooled connections are returned to the pool, the others are closed.
+        Helpers using a connection only briefly should call it instead of
+        `close()`, so that the connection can be reused.
+        """
+        if conn in self._conns:
+            self._conns.remove(conn)
+
+        if pool and conn in get_pool():
+            get_pool().putconn(conn)
+        elif not conn.closed:
+            conn.close()
+
     def repl_connect(self, **kwargs):
         """Return a connection set up for replication
 
@@ -144,6 +619,9 @@ class ConnectingTestCase(unittest.TestCase):
         if repl_dsn is None:
             return self.skipTest("replication tests disabled by default")
 
+        if repl_dsn == dsn and not server_caps(self.conn).can_replicate:
+            return self.skipTest("the test user can't start replication")
+
         if "dsn" not in kwargs:
             kwargs["dsn"] = repl_dsn
         try:
@@ -174,19 +652,20 @@ class ConnectingTestCase(unittest.TestCase):
 
     # for use with async connections only
     def wait(self, cur_or_conn):
-        pollable = cur_or_conn
-        if not hasattr(pollable, "poll"):
-            pollable = cur_or_conn.connection
-        while True:
-            state = pollable.poll()
-            if state == psycopg2.extensions.POLL_OK:
-                break
-            elif state == psycopg2.extensions.POLL_READ:
-                select.select([pollable], [], [], 1)
-            elif state == psycopg2.extensions.POLL_WRITE:
-                select.select([], [pollable], [], 1)
-            else:
-                raise Exception("Unexpected result from poll: %r", state)
+        self.waiter.wait_all([cur_or_conn])
+
+    def wait_all(self, objs):
+        """Wait for the completion of the operations on many async objects."""
+        self.waiter.wait_all(objs)
+
+    @property
+    def waiter(self):
+        """The `Waiter` used by `wait()`, holding the stats of the test."""
+        try:
+            return self._waiter
+        except AttributeError:
+            self._waiter = Waiter()
+            return self._waiter
 
     _libpq = None
 
@@ -203,6 +682,367 @@ class ConnectingTestCase(unittest.TestCase):
         rv = ConnectingTestCase._libpq = ctypes.pydll.LoadLibrary(libname)
         return rv
 
+    @contextmanager
+    def trace(self, conn, flags=0):
+        """Trace the protocol messages exchanged by *conn* in the block.
+
+        *flags* are passed to `!PQsetTraceFlags()`, e.g.
+        `PQTRACE_SUPPRESS_TIMESTAMPS`. Return a `ProtocolTrace`, filled with
+        the messages at the end of the block. Skip the test if libpq doesn't
+        produce a trace we can parse.
+        """
+        libpq = _trace_libpq()
+        if libpq is None:
+            # PQsetTraceFlags() and the trace format parsed are new in libpq 14
+            raise self.skipTest("protocol trace requires libpq 14")
+
+        libc_name = find_library("c")
+        if libc_name is None:
+            raise self.skipTest("can't find the C library to trace libpq")
+        libc = ctypes.CDLL(libc_name)
+        libc.fopen.restype = ctypes.c_void_p
+        libc.fopen.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
+        libc.fclose.argtypes = [ctypes.c_void_p]
+
+        pgconn = native_pointer(conn)
+        fd, filename = tempfile.mkstemp(prefix="psycopg2_trace_")
+        os.close(fd)
+        fp = libc.fopen(filename.encode(), b"w")
+        libpq.PQtrace(pgconn, fp)
+        libpq.PQsetTraceFlags(pgconn, flags)
+        trace = ProtocolTrace()
+        try:
+            yield trace
+        finally:
+            libpq.PQuntrace(pgconn)
+            libc.fclose(fp)
+            with open(filename) as f:
+                trace.parse(f)
+            os.remove(filename)
+
+
+_trace_lib = None
+
+
+def _trace_libpq():
+    """Return the libpq functions to trace a connection, None if not available.
+
+    The functions are looked up through the psycopg2 extension module: the
+    connections must be traced by the same libpq managing them, which may not
+    be the one found on the system.
+    """
+    global _trace_lib
+    if _trace_lib is not None:
+        return _trace_lib or None
+
+    lib = ctypes.CDLL(psycopg2._psycopg.__file__)
+    try:
+        for name, argtypes in [
+            ("PQtrace", [ctypes.c_void_p, ctypes.c_void_p]),
+            ("PQsetTraceFlags", [ctypes.c_void_p, ctypes.c_int]),
+            ("PQuntrace", [ctypes.c_void_p]),
+        ]:
+            f = getattr(lib, name)
+            f.restype = None
+            f.argtypes = argtypes
+    except AttributeError:
+        _trace_lib = False
+        return None
+
+    _trace_lib = lib
+    return lib
+
+
+def native_pointer(conn):
+    """Return the address of the libpq PGconn wrapped by a psycopg connection."""
+    capsule = conn.get_native_connection()
+    api = ctypes.pythonapi
+    api.PyCapsule_GetName.restype = ctypes.c_char_p
+    api.PyCapsule_GetName.argtypes = [ctypes.py_object]
+    api.PyCapsule_GetPointer.restype = ctypes.c_void_p
+    api.PyCapsule_GetPointer.argtypes = [ctypes.py_object, ctypes.c_char_p]
+    return api.PyCapsule_GetPointer(capsule, api.PyCapsule_GetName(capsule))
+
+
+# Flags for ConnectingTestCase.trace(), as in libpq-fe.h
+PQTRACE_SUPPRESS_TIMESTAMPS = 1 << 0
+PQTRACE_REGRESS_MODE = 1 << 1
+
+
+class ProtocolTrace(object):
+    """The protocol messages exchanged by a connection, parsed from a libpq trace.
+
+    `messages` is a list of (time, direction, name, size) tuples, where *time*
+    is the seconds elapsed since the previous message (None if libpq didn't
+    trace timestamps) and *direction* is "F" for the messages sent by the
+    client and "B" for the ones sent by the server.
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def parse(self, f):
+        """Parse the trace produced by libpq >= 14 from the file *f*."""
+        last = None
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            t = None
+            if parts[0] not in ("F", "B"):
+                ts = datetime.datetime.strptime(parts.pop(0), "%Y-%m-%d %H:%M:%S.%f")
+                if last is not None:
+                    t = (ts - last).total_seconds()
+                last = ts
+            if len(parts) < 3:
+                continue
+            self.messages.append((t, parts[0], parts[2], int(parts[1])))
+
+    def count(self, name, direction=None):
+        """Return the number of messages *name*, optionally in a *direction*."""
+        return sum(
+            1
+            for m in self.messages
+            if m[2] == name and (direction is None or m[1] == direction)
+        )
+
+
+class ServerCapabilities(object):
+    """The features available on the test server.
+
+    Use `server_caps()` to obtain the capabilities of the test server.
+    """
+
+    _fields = (
+        "server_version",
+        "has_uuid",
+        "has_json",
+        "has_hstore",
+        "max_prepared_transactions",
+        "is_superuser",
+        "can_replicate",
+        "wal_level",
+        "max_replication_slots",
+    )
+
+    def __init__(self, **kwargs):
+        for k in self._fields:
+            setattr(self, k, kwargs[k])
+
+    @classmethod
+    def probe(cls, conn):
+        """Query the server on *conn* to find out its capabilities."""
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                select typname from pg_type
+                where typname in ('uuid', 'json', 'hstore')"""
+            )
+            types = set(r[0] for r in cur)
+            cur.execute(
+                """
+                select name, setting from pg_settings
+                where name in ('max_prepared_transactions', 'is_superuser',
+                    'wal_level', 'max_replication_slots')"""
+            )
+            settings = dict(cur.fetchall())
+            if conn.info.server_version >= 90100:
+                cur.execute(
+                    """
+                    select rolreplication or rolsuper from pg_roles
+                    where rolname = current_user"""
+                )
+                can_replicate = cur.fetchone()[0]
+            else:
+                can_replicate = settings.get("is_superuser") == "on"
+        finally:
+            conn.rollback()
+
+        mpt = settings.get("max_prepared_transactions")
+        return cls(
+            server_version=conn.info.server_version,
+            has_uuid="uuid" in types,
+            has_json="json" in types,
+            has_hstore="hstore" in types,
+            max_prepared_transactions=int(mpt) if mpt is not None else None,
+            is_superuser=settings.get("is_superuser") == "on",
+            can_replicate=can_replicate,
+            wal_level=settings.get("wal_level"),
+            max_replication_slots=int(settings.get("max_replication_slots", 0)),
+        )
+
+    @staticmethod
+    def _file_key(dsn, server_version):
+        # don't write passwords around
+        return "%s-%s" % (
+            hashlib.sha1(dsn.encode("utf8")).hexdigest(),
+            server_version,
+        )
+
+    @classmethod
+    def load(cls, filename, dsn, server_version):
+        """Return the capabilities saved in *filename*, None if not found."""
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        data = data.get(cls._file_key(dsn, server_version))
+        if data is not None:
+            return cls(**data)
+
+    def save(self, filename, dsn):
+        """Save the capabilities in *filename*, preserving other servers' ones."""
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            data = {}
+
+        data[self._file_key(dsn, self.server_version)] = dict(
+            (k, getattr(self, k)) for k in self._fields
+        )
+
+        # Parallel workers may save at the same time: replace the file in one
+        # go, so that it is never found half written. A concurrent update may
+        # be lost, which only costs a probe in the following run.
+        fd, tmpname = tempfile.mkstemp(
+            prefix=os.path.basename(filename) + ".",
+            dir=os.path.dirname(os.path.abspath(filename)),
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            _replace(tmpname, filename)
+        except Exception:
+            os.remove(tmpname)
+            raise
+
+
+# os.replace() is not available on Python 2, where rename() replaces on Unix
+_replace = getattr(os, "replace", os.rename)
+
+
+_server_caps = None
+
+
+def server_caps(conn=None):
+    """Return the capabilities of the test server.
+
+    The server is probed only once per session. If "PSYCOPG2_TEST_CAPS_CACHE"
+    is set, the capabilities are also saved into that file and reused by the
+    following runs against the same dsn and server version. If *conn* is a
+    connection to the test database, it is used to read the server version
+    without connecting again.
+    """
+    global _server_caps
+    if _server_caps is not None:
+        return _server_caps
+
+    caps = None
+    if caps_cache and conn is not None and not conn.closed:
+        caps = ServerCapabilities.load(caps_cache, dsn, conn.info.server_version)
+
+    if caps is None:
+        cnn = psycopg2.connect(dsn)
+        try:
+            caps = ServerCapabilities.probe(cnn)
+        finally:
+            cnn.close()
+        if caps_cache:
+            caps.save(caps_cache, dsn)
+
+    _server_caps = caps
+    return caps
+
+
+_shared_tables = set()
+
+
+def shared_table(name, columns, rows=()):
+    """Create a table shared by all the tests of the session.
+
+    The table is (re)created with the *columns* definition, unlogged if the
+    server supports it, and filled with *rows* the first time it is requested
+    in the session; the following calls return immediately. The tests using it
+    must leave its content unchanged, e.g. by not committing their changes.
+    """
+    if name in _shared_tables:
+        return
+
+    conn = psycopg2.connect(dsn)
+    try:
+        unlogged = conn.info.server_version >= 90100 and "unlogged " or ""
+        cur = conn.cursor()
+        cur.execute("drop table if exists %s" % name)
+        cur.execute("create %stable %s (%s)" % (unlogged, name, columns))
+        if rows:
+            cur.executemany(
+                "insert into %s values (%s)" % (name, ", ".join(["%s"] * len(rows[0]))),
+                rows,
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+    _shared_tables.add(name)
+
+
+class Waiter(object):
+    """Complete the operations of async connections and cursors.
+
+    Many objects can be waited for concurrently on a single thread. The number
+    of `!poll()` calls and the seconds spent blocked waiting for the sockets
+    are accumulated in the `polls` and `blocked` attributes.
+    """
+
+    # Poll again the objects not ready after this number of seconds
+    timeout = 1.0
+
+    def __init__(self):
+        self.polls = 0
+        self.blocked = 0.0
+
+    def wait(self, cur_or_conn):
+        self.wait_all([cur_or_conn])
+
+    def wait_all(self, objs):
+        """Wait until all the *objs* are ready."""
+        todo = []
+        for obj in objs:
+            pollable = obj if hasattr(obj, "poll") else obj.connection
+            if pollable not in todo:
+                todo.append(pollable)
+
+        ext = psycopg2.extensions
+        # pollable -> the POLL_READ/POLL_WRITE state it is waiting in
+        waiting = {}
+        while todo:
+            for pollable in todo:
+                self.polls += 1
+                state = pollable.poll()
+                if state == ext.POLL_OK:
+                    continue
+                elif state in (ext.POLL_READ, ext.POLL_WRITE):
+                    waiting[pollable] = state
+                else:
+                    raise Exception("Unexpected result from poll: %r", state)
+
+            if not waiting:
+                break
+
+            rlist = [p for p, s in waiting.items() if s == ext.POLL_READ]
+            wlist = [p for p, s in waiting.items() if s == ext.POLL_WRITE]
+            t0 = time.time()
+            rready, wready, xready = select.select(rlist, wlist, [], self.timeout)
+            self.blocked += time.time() - t0
+
+            # the socket may change while connecting: poll again what is
+            # ready, or everything on timeout, before waiting again
+            todo = rready + wready or list(waiting)
+            for pollable in todo:
+                del waiting[pollable]
+
 
 def decorate_all_tests(obj, *decorators):
     """
@@ -235,14 +1075,7 @@ def skip_if_no_uuid(f):
 
     @wraps(f)
     def skip_if_no_uuid_(self):
-        try:
-            cur = self.conn.cursor()
-            cur.execute("select typname from pg_type where typname = 'uuid'")
-            has = cur.fetchone()
-        finally:
-            self.conn.rollback()
-
-        if has:
+        if server_caps(self.conn).has_uuid:
             return f(self)
         else:
             return self.skipTest("uuid type not available on the server")
@@ -256,17 +1089,11 @@ def skip_if_tpc_disabled(f):
 
     @wraps(f)
     def skip_if_tpc_disabled_(self):
-        cnn = self.connect()
-        cur = cnn.cursor()
-        try:
-            cur.execute("SHOW max_prepared_transactions;")
-        except psycopg2.ProgrammingError:
+        mtp = server_caps(self.conn).max_prepared_transactions
+        if mtp is None:
             return self.skipTest(
                 "server too old: two phase transactions not supported."
             )
-        else:
-            mtp = int(cur.fetchone()[0])
-        cnn.close()
 
         if not mtp:
             return self.skipTest(
@@ -290,10 +1117,10 @@ def skip_before_postgres(*ver):
     def skip_before_postgres_(f):
         @wraps(f)
         def skip_before_postgres__(self):
-            if self.conn.info.server_version < int("%d%02d%02d" % ver):
+            server_version = server_caps(self.conn).server_version
+            if server_version < int("%d%02d%02d" % ver):
                 return self.skipTest(
-                    reason
-                    or "skipped because PostgreSQL %s" % self.conn.info.server_version
+                    reason or "skipped because PostgreSQL %s" % server_version
                 )
             else:
                 return f(self)
@@ -311,10 +1138,9 @@ def skip_after_postgres(*ver):
     def skip_after_postgres_(f):
         @wraps(f)
         def skip_after_postgres__(self):
-            if self.conn.info.server_version >= int("%d%02d%02d" % ver):
-                return self.skipTest(
-                    "skipped because PostgreSQL %s" % self.conn.info.server_version
-                )
+            server_version = server_caps(self.conn).server_version
+            if server_version >= int("%d%02d%02d" % ver):
+                return self.skipTest("skipped because PostgreSQL %s" % server_version)
             else:
                 return f(self)
 
@@ -443,9 +1269,10 @@ class py3_raises_typeerror(object):
 def slow(f):
     """Decorator to mark slow tests we may want to skip
 
-    Note: in order to find slow tests you can run:
+    Note: in order to find slow tests you can run the suite with the timing
+    runner, which reports the slowest tests and the ones deserving the marker:
 
-    make check 2>&1 | ts -i "%.s" | sort -n
+    python -m tests.testtiming --slow-threshold 1.0
     """
 
     @wraps(f)
@@ -454,6 +1281,7 @@ def slow(f):
             return self.skipTest("slow test")
         return f(self)
 
+    slow_.slow = True
     return slow_
 
 